@@ -5,8 +5,8 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)  # Ensure logger is defined
 
-def postmsg(access_token, recipient_id, message_to_be_sent):
-    """Sends a direct message to Instagram."""
+def build_postmsg_request(access_token, recipient_id, message_to_be_sent):
+    """Builds the url, headers and body of an Instagram DM request, shared by the sync and async senders."""
     logger.info(f"Post Function Triggered: Sending DM to recipient {recipient_id} using access token: {access_token}")
     url = "https://graph.instagram.com/v21.0/me/messages"
     headers = {
@@ -21,8 +21,20 @@ def postmsg(access_token, recipient_id, message_to_be_sent):
             "text": message_to_be_sent
         }
     }
+    return {"url": url, "headers": headers, "json": json_body}
 
-    response = requests.post(url, headers=headers, json=json_body)
+def read_postmsg_response(response):
+    """Decodes and logs the Instagram API response."""
     data = response.json()
     logger.info(f"Response from Instagram API: {data}")
-    return data
\ No newline at end of file
+    return data
+
+def postmsg(access_token, recipient_id, message_to_be_sent):
+    """Sends a direct message to Instagram."""
+    response = requests.post(**build_postmsg_request(access_token, recipient_id, message_to_be_sent))
+    return read_postmsg_response(response)
+
+async def postmsg_async(client, access_token, recipient_id, message_to_be_sent):
+    """Sends a direct message to Instagram using a shared httpx.AsyncClient."""
+    response = await client.post(**build_postmsg_request(access_token, recipient_id, message_to_be_sent))
+    return read_postmsg_response(response)
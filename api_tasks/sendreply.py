@@ -5,8 +5,8 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)  # Ensure logger is defined
 
-def sendreply(access_token, comment_id, message_to_be_sent):
-    """Sends a reply to an Instagram comment."""
+def build_sendreply_request(access_token, comment_id, message_to_be_sent):
+    """Builds the url and params of an Instagram comment reply, shared by the sync and async senders."""
     logger.info(f"Send Reply Function Triggered: Sending reply to comment {comment_id} using access token: {access_token}")
     url = f"https://graph.instagram.com/v22.0/{comment_id}/replies"
 
@@ -14,8 +14,20 @@ def sendreply(access_token, comment_id, message_to_be_sent):
         "message": message_to_be_sent,
         "access_token": access_token
     }
+    return {"url": url, "params": params}
 
-    response = requests.post(url, params=params)
+def read_sendreply_response(response):
+    """Decodes and logs the Instagram Reply API response."""
     data = response.json()
     logger.info(f"Response from Instagram Reply API: {data}")
-    return data
\ No newline at end of file
+    return data
+
+def sendreply(access_token, comment_id, message_to_be_sent):
+    """Sends a reply to an Instagram comment."""
+    response = requests.post(**build_sendreply_request(access_token, comment_id, message_to_be_sent))
+    return read_sendreply_response(response)
+
+async def sendreply_async(client, access_token, comment_id, message_to_be_sent):
+    """Sends a reply to an Instagram comment using a shared httpx.AsyncClient."""
+    response = await client.post(**build_sendreply_request(access_token, comment_id, message_to_be_sent))
+    return read_sendreply_response(response)
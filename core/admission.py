@@ -0,0 +1,140 @@
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+# Degradation levels, each including the ones below it
+NORMAL = 0
+TEMPLATE_ONLY = 1  # Skip the LLM and reply with the configured default responses
+SAMPLE_SIDE_WORK = 2  # Only publish/persist a sample of webhook events
+DEFER_COMMENTS = 3  # Push low-priority comment replies further out
+
+LEVEL_NAMES = {
+    NORMAL: "normal",
+    TEMPLATE_ONLY: "template_only",
+    SAMPLE_SIDE_WORK: "sample_side_work",
+    DEFER_COMMENTS: "defer_comments",
+}
+
+
+class AdmissionController:
+    """
+    Decides how much work /webhook admits based on current load.
+
+    Four signals are compared with their limits: scheduled work (queue depth), event-loop
+    lag, the downstream (Gemini) error rate and webhook ack latency. The highest ratio is
+    the pressure: at 1x the controller goes to TEMPLATE_ONLY, at 1.5x to SAMPLE_SIDE_WORK
+    and at 2x to DEFER_COMMENTS. It steps up immediately and steps down one level at a
+    time once pressure has stayed below the current level's bound for `cooldown` seconds.
+    """
+    LEVEL_BOUNDS = ((2.0, DEFER_COMMENTS), (1.5, SAMPLE_SIDE_WORK), (1.0, TEMPLATE_ONLY))
+
+    def __init__(
+        self,
+        max_queue_depth: int,
+        max_loop_lag: float,
+        max_error_rate: float,
+        ack_budget: float,
+        cooldown: float = 30,
+        sample_keep_every: int = 10,
+        window: float = 60,
+    ):
+        self.max_queue_depth = max_queue_depth
+        self.max_loop_lag = max_loop_lag  # Seconds
+        self.max_error_rate = max_error_rate  # Fraction of failed downstream calls
+        self.ack_budget = ack_budget  # Seconds; well under Meta's webhook timeout
+        self.cooldown = cooldown
+        self.sample_keep_every = sample_keep_every
+        self.window = window  # Seconds of history for lag, error rate and ack latency
+
+        self.level = NORMAL
+        self.shed: Counter = Counter()  # Action -> number of times work was shed
+        self._signals: Dict[str, float] = {}
+        self._calm_since: Optional[float] = None
+        self._sample_counter = 0
+        self._loop_lag: Deque[Tuple[float, float]] = deque(maxlen=1000)
+        self._downstream: Deque[Tuple[float, bool]] = deque(maxlen=1000)
+        self._acks: Deque[Tuple[float, float]] = deque(maxlen=1000)
+
+    def _recent(self, samples: Deque[Tuple[float, Any]], now: float) -> list:
+        return [value for at, value in samples if now - at <= self.window]
+
+    def observe_loop_lag(self, lag: float, now: Optional[float] = None) -> None:
+        """Record how late the event loop ran a scheduled callback."""
+        self._loop_lag.append((time.time() if now is None else now, lag))
+
+    def record_downstream(self, ok: bool, now: Optional[float] = None) -> None:
+        """
+        Record the outcome of a downstream (LLM) call made while handling a webhook.
+
+        Only calls made by this web worker count; DM replies generated by Celery or async
+        workers run in other processes and do not feed the error rate.
+        """
+        self._downstream.append((time.time() if now is None else now, ok))
+
+    def record_ack(self, seconds: float, now: Optional[float] = None) -> None:
+        """Record how long a webhook took to acknowledge."""
+        self._acks.append((time.time() if now is None else now, seconds))
+
+    def update(self, queue_depth: int, now: Optional[float] = None) -> int:
+        """
+        Re-evaluate the degradation level from the current signals.
+
+        Args:
+            queue_depth: Work currently admitted and not yet done (scheduled replies, buffered SSE events).
+            now: Current time in seconds since the epoch (defaults to the current time).
+
+        Returns:
+            The degradation level to apply to the webhook being handled.
+        """
+        now = time.time() if now is None else now
+        lags = self._recent(self._loop_lag, now)
+        outcomes = self._recent(self._downstream, now)
+        acks = sorted(self._recent(self._acks, now))
+
+        self._signals = {
+            "queue_depth": queue_depth,
+            "loop_lag_seconds": round(max(lags), 4) if lags else 0.0,
+            "downstream_error_rate": round(outcomes.count(False) / len(outcomes), 3) if outcomes else 0.0,
+            "ack_p95_seconds": round(acks[int(0.95 * (len(acks) - 1))], 4) if acks else 0.0,
+        }
+        pressure = max(
+            queue_depth / self.max_queue_depth,
+            self._signals["loop_lag_seconds"] / self.max_loop_lag,
+            self._signals["downstream_error_rate"] / self.max_error_rate,
+            self._signals["ack_p95_seconds"] / self.ack_budget,
+        )
+        self._signals["pressure"] = round(pressure, 3)
+
+        target = next((level for bound, level in self.LEVEL_BOUNDS if pressure >= bound), NORMAL)
+        if target >= self.level:
+            self.level = target
+            self._calm_since = None
+        elif self._calm_since is None:
+            self._calm_since = now
+        elif now - self._calm_since >= self.cooldown:
+            self.level -= 1  # Recover one step at a time
+            self._calm_since = now if self.level > target else None
+        return self.level
+
+    def keep_sample(self) -> bool:
+        """Whether this event's SSE/persistence work should be kept while sampling."""
+        self._sample_counter += 1
+        return self._sample_counter % self.sample_keep_every == 0
+
+    def record_shed(self, action: str) -> None:
+        """Count a piece of work that was degraded or dropped."""
+        self.shed[action] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report the current level, the signals it was based on and shed counts.
+
+        Returns:
+            A dictionary suitable for the /health endpoint.
+        """
+        return {
+            "level": self.level,
+            "mode": LEVEL_NAMES[self.level],
+            "signals": self._signals,
+            "shed": dict(self.shed),
+        }
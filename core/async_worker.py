@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import queue
+import signal
+import socket
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from celery.utils.collections import LimitedSet
+from kombu import Consumer
+
+logger = logging.getLogger(__name__)  # Ensure logger is defined
+
+AsyncHandler = Callable[..., Awaitable[Any]]
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    """Convert an ISO 8601 eta/expires header to seconds since the epoch."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)  # Celery is configured with enable_utc
+    return parsed.timestamp()
+
+
+class AsyncWorker:
+    """
+    Runs Celery tasks as coroutines on a single asyncio event loop.
+
+    Meant for I/O-bound tasks: each in-flight task is a coroutine rather than a pool
+    process, and at most `concurrency` of them execute at once. Messages are read from
+    the same queues, with the same task names and arguments, as a regular Celery worker.
+
+    A consumer thread owns the broker connection (kombu channels are not thread-safe):
+    it hands messages to the loop and acks them once the loop reports them finished.
+    Tasks with a countdown sleep on the loop until their eta without holding a
+    concurrency slot. Revokes broadcast by celery.control.revoke() are honoured for
+    tasks that have not started executing; other control commands can be served by
+    passing `control_handlers` (name -> handler(state, **arguments), as registered with
+    celery.worker.control).
+    """
+    def __init__(
+        self,
+        app,
+        handlers: Dict[str, AsyncHandler],
+        queues: List[str],
+        concurrency: int,
+        prefetch: int,
+        hostname: Optional[str] = None,
+        on_task_start: Optional[Callable[[Dict[str, Any]], None]] = None,
+        on_shutdown: Optional[Callable[[], Awaitable[None]]] = None,
+        shutdown_timeout: float = 30,
+        control_handlers: Optional[Dict[str, Callable[..., Any]]] = None,
+    ):
+        self.app = app
+        self.handlers = handlers  # Celery task name -> coroutine function
+        self.queues = queues
+        self.concurrency = concurrency
+        self.prefetch = prefetch  # Unacked messages, including ones waiting for their eta
+        self.hostname = hostname or f"async@{socket.gethostname()}"
+        self.on_task_start = on_task_start  # Called with the message headers before a task executes
+        self.on_shutdown = on_shutdown
+        self.shutdown_timeout = shutdown_timeout
+        self.control_handlers = control_handlers or {}  # Run on the consumer thread
+
+        self.revoked = LimitedSet(maxlen=50000, expires=3 * 3600)
+        self._acks: "queue.Queue[Any]" = queue.Queue()  # Messages the loop is done with
+        self._jobs: Dict[str, asyncio.Task] = {}
+        self._executing: Dict[str, Dict[str, Any]] = {}
+        self._stop_consumer = threading.Event()
+        self._stopping = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._stop: Optional[asyncio.Event] = None
+
+    # --- Consumer thread ---
+
+    def _consume(self) -> None:
+        """Read task messages and control broadcasts until asked to stop."""
+        with self.app.connection_for_read() as connection:
+            task_queues = [self.app.amqp.queues[name] for name in self.queues]
+            consumer = Consumer(
+                connection.default_channel, queues=task_queues, callbacks=[self._on_message],
+                accept=['json'], prefetch_count=self.prefetch
+            )
+            consumer.consume()
+
+            handlers = defaultdict(lambda: self._unsupported, self.control_handlers)
+            handlers.update(revoke=self._revoke, ping=self._ping, active=self._active)
+            node = self.app.control.mailbox(connection).Node(self.hostname, handlers=handlers, channel=connection.channel())
+            node.listen()
+            logger.info(f"Async worker {self.hostname} consuming {self.queues} (concurrency {self.concurrency})")
+
+            while not self._stop_consumer.is_set():
+                try:
+                    connection.drain_events(timeout=0.5)
+                except socket.timeout:
+                    pass
+                except Exception as e:
+                    logger.error(f"Async worker lost broker connection: {e}")
+                    time.sleep(1)
+                    connection.ensure_connection(max_retries=None)
+                    consumer.revive(connection.default_channel)
+                    consumer.consume()
+                    node.listen(channel=connection.channel())
+                self._flush_acks()
+            self._flush_acks()
+            # Unacked messages (tasks still waiting for their eta) go back to the broker on close
+
+    def _flush_acks(self) -> None:
+        while True:
+            try:
+                message = self._acks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                message.ack()
+            except Exception as e:
+                logger.error(f"Failed to ack message: {e}")
+
+    def _on_message(self, body: Any, message) -> None:
+        task_name = message.headers.get('task')
+        if task_name not in self.handlers:
+            logger.error(f"Received unregistered task '{task_name}'. Discarding.")
+            message.ack()
+            return
+        self._loop.call_soon_threadsafe(self._start_job, body, message)
+
+    def _revoke(self, state, task_id, terminate: bool = False, **kwargs) -> Dict[str, str]:
+        task_ids = [task_id] if isinstance(task_id, str) else list(task_id)
+        for revoked_id in task_ids:
+            self.revoked.add(revoked_id)
+            self._loop.call_soon_threadsafe(self._cancel_waiting, revoked_id)
+        return {'ok': f"tasks {', '.join(task_ids)} flagged as revoked"}
+
+    def _ping(self, state, **kwargs) -> Dict[str, str]:
+        return {'ok': 'pong'}
+
+    def _active(self, state, **kwargs) -> List[Dict[str, Any]]:
+        # _executing belongs to the event loop thread; copy it there
+        return asyncio.run_coroutine_threadsafe(self._list_executing(), self._loop).result(timeout=5)
+
+    async def _list_executing(self) -> List[Dict[str, Any]]:
+        return list(self._executing.values())
+
+    def _unsupported(self, state, **kwargs) -> Dict[str, str]:
+        return {'error': 'not supported by the async worker'}
+
+    # --- Event loop ---
+
+    def _start_job(self, body: Any, message) -> None:
+        task_id = message.headers['id']
+        if self._stopping:
+            return  # Left unacked so the broker redelivers it
+        if task_id in self.revoked:
+            logger.info(f"Discarding revoked task {task_id}")
+            self._acks.put(message)
+            return
+        self._jobs[task_id] = asyncio.create_task(self._run_job(body, message))
+
+    def _cancel_waiting(self, task_id: str) -> None:
+        job = self._jobs.get(task_id)
+        if job is not None and task_id not in self._executing:
+            job.cancel()
+
+    async def _run_job(self, body: Any, message) -> None:
+        headers = message.headers
+        task_id, task_name = headers['id'], headers['task']
+        ack = True
+        try:
+            eta = _parse_time(headers.get('eta'))
+            if eta is not None and eta > time.time():
+                await asyncio.sleep(eta - time.time())
+
+            expires = _parse_time(headers.get('expires'))
+            if expires is not None and expires < time.time():
+                logger.info(f"Task {task_name}[{task_id}] expired. Discarding.")
+                return
+
+            args, kwargs, _embed = body
+            async with self._semaphore:
+                if task_id in self.revoked:
+                    logger.info(f"Discarding revoked task {task_id}")
+                    return
+                self._executing[task_id] = {'id': task_id, 'name': task_name, 'args': args, 'hostname': self.hostname}
+                if self.app.conf.task_track_started:
+                    await asyncio.to_thread(self.app.backend.mark_as_started, task_id, hostname=self.hostname)
+                if self.on_task_start is not None:
+                    self.on_task_start(headers)
+                try:
+                    result = await self.handlers[task_name](*args, **kwargs)
+                except Exception as e:
+                    logger.error(f"Task {task_name}[{task_id}] raised: {e}")
+                    await asyncio.to_thread(self.app.backend.mark_as_failure, task_id, e)
+                else:
+                    logger.info(f"Task {task_name}[{task_id}] succeeded")
+                    await asyncio.to_thread(self.app.backend.mark_as_done, task_id, result)
+        except asyncio.CancelledError:
+            if task_id in self.revoked:
+                logger.info(f"Revoked task {task_id} before it ran")
+            else:
+                ack = False  # Shutting down; the broker redelivers the message
+        finally:
+            self._executing.pop(task_id, None)
+            self._jobs.pop(task_id, None)
+            if ack:
+                self._acks.put(message)
+
+    async def _main(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._stop = asyncio.Event()
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                self._loop.add_signal_handler(sig, self._stop.set)
+
+        consumer_thread = threading.Thread(target=self._consume, name="async-worker-consumer", daemon=True)
+        consumer_thread.start()
+        await self._stop.wait()
+
+        logger.info(f"Async worker {self.hostname} shutting down")
+        self._stopping = True
+        for task_id, job in list(self._jobs.items()):
+            if task_id not in self._executing:
+                job.cancel()  # Not started yet; leave the message for the next worker
+        if self._jobs:
+            await asyncio.wait(list(self._jobs.values()), timeout=self.shutdown_timeout)
+        if self.on_shutdown is not None:
+            await self.on_shutdown()
+
+        self._stop_consumer.set()
+        await asyncio.to_thread(consumer_thread.join)
+
+    def run(self) -> None:
+        """Run the worker until SIGINT/SIGTERM or stop()."""
+        asyncio.run(self._main())
+
+    def stop(self) -> None:
+        """Ask a running worker to shut down. Safe to call from any thread."""
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
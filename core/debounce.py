@@ -0,0 +1,175 @@
+import statistics
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+
+
+class _Burst:
+    """State of one conversation: recent typing gaps and the reply currently being debounced."""
+    __slots__ = ("gaps", "first_at", "last_at", "due_at", "replied_at")
+
+    def __init__(self, history: int):
+        self.gaps: Deque[float] = deque(maxlen=history)
+        self.first_at: Optional[float] = None  # First message of the pending burst
+        self.last_at: Optional[float] = None  # Last message seen in this conversation
+        self.due_at: Optional[float] = None  # When the pending reply is scheduled to go out
+        self.replied_at: Optional[float] = None  # When the last reply went out
+
+
+class DebouncePolicy:
+    """
+    Adaptive debounce for batching a user's DMs into a single reply.
+
+    The quiet period after each message is derived from the gaps observed between
+    messages, first in the same conversation and otherwise across the account: a high
+    quantile of the gaps times a safety margin, clamped to [min_delay, max_delay] and
+    never past max_total_wait after the first message of the burst.
+
+    A message arriving within split_window after a reply went out counts as a split
+    reply. Only gaps between messages of the same pending burst are learned, so normal
+    reply/answer turns do not stretch the window.
+    """
+    def __init__(
+        self,
+        min_delay: float,
+        max_delay: float,
+        max_total_wait: float,
+        default_delay: float,
+        gap_quantile: float = 0.9,
+        margin: float = 1.5,
+        split_window: float = 120,
+        min_samples: int = 3,
+        max_conversations: int = 10000,
+    ):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_total_wait = max_total_wait
+        self.default_delay = default_delay  # Used until enough gaps have been observed
+        self.gap_quantile = gap_quantile
+        self.margin = margin
+        self.split_window = split_window
+        self.min_samples = min_samples
+        self.max_conversations = max_conversations
+
+        self._conversations: "OrderedDict[str, _Burst]" = OrderedDict()
+        self._account_gaps: Dict[str, Deque[float]] = {}
+        self._latencies: Deque[float] = deque(maxlen=1000)  # Seconds from first message to reply
+        self.replies = 0
+        self.split_replies = 0
+
+    def _quantile(self, gaps: Deque[float]) -> float:
+        ordered = sorted(gaps)
+        index = min(len(ordered) - 1, int(self.gap_quantile * len(ordered)))
+        return ordered[index]
+
+    def _window(self, burst: _Burst, account_id: str) -> float:
+        """Quiet period to wait after the latest message, before the total-wait cap."""
+        account_gaps = self._account_gaps.get(account_id, ())
+        if len(burst.gaps) >= self.min_samples:
+            window = self._quantile(burst.gaps) * self.margin
+        elif len(account_gaps) >= self.min_samples:
+            window = self._quantile(account_gaps) * self.margin
+        else:
+            window = self.default_delay
+        return min(max(window, self.min_delay), self.max_delay)
+
+    def _finish(self, burst: _Burst) -> None:
+        """Close a burst whose reply has gone out and record its reply latency."""
+        self._latencies.append(burst.due_at - burst.first_at)
+        self.replies += 1
+        burst.replied_at = burst.due_at
+        burst.first_at = None
+        burst.due_at = None
+
+    def observe(self, conversation_id: str, account_id: str, now: Optional[float] = None) -> float:
+        """
+        Record an incoming DM and decide how long to wait before replying.
+
+        Args:
+            conversation_id: The conversation the message belongs to.
+            account_id: The Instagram account receiving the message.
+            now: Arrival time in seconds since the epoch (defaults to the current time).
+
+        Returns:
+            Seconds from now until the (re)scheduled reply should be sent.
+        """
+        now = time.time() if now is None else now
+
+        burst = self._conversations.pop(conversation_id, None) or _Burst(history=20)
+        self._conversations[conversation_id] = burst  # Move to the end (most recently used)
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+
+        if burst.due_at is not None and now >= burst.due_at:
+            self._finish(burst)  # The previous reply already went out
+
+        if burst.first_at is not None:
+            # Only gaps inside a pending burst are typing gaps; a message after the reply went out
+            # includes our wait and the user's reading time, and would push the window up each turn
+            gap = now - burst.last_at
+            burst.gaps.append(gap)
+            self._account_gaps.setdefault(account_id, deque(maxlen=200)).append(gap)
+        burst.last_at = now
+
+        if burst.first_at is None:
+            if burst.replied_at is not None and now - burst.replied_at <= self.split_window:
+                self.split_replies += 1  # The user was still typing when we replied
+            burst.first_at = now
+        remaining = burst.first_at + self.max_total_wait - now
+        delay = max(0.0, min(self._window(burst, account_id), remaining))
+        burst.due_at = now + delay
+        return round(delay, 1)
+
+    def export_burst(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Export a conversation's pending burst so it can survive a restart.
+
+        Args:
+            conversation_id: The conversation to export.
+
+        Returns:
+            The burst's first/last message times and typing gaps, or None if no reply is pending.
+        """
+        burst = self._conversations.get(conversation_id)
+        if burst is None or burst.first_at is None:
+            return None
+        return {"first_at": burst.first_at, "last_at": burst.last_at, "gaps": list(burst.gaps)}
+
+    def restore_burst(self, conversation_id: str, state: Dict[str, Any], due_at: float) -> None:
+        """
+        Restore a burst exported by export_burst, so max_total_wait still counts from its first message.
+
+        Args:
+            conversation_id: The conversation to restore.
+            state: The exported burst.
+            due_at: When the rescheduled reply goes out.
+        """
+        burst = _Burst(history=20)
+        burst.gaps.extend(state["gaps"])
+        burst.first_at = state["first_at"]
+        burst.last_at = state["last_at"]
+        burst.due_at = due_at
+        self._conversations[conversation_id] = burst
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+
+    def stats(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Report reply latency and split-reply counts for bursts whose reply has gone out.
+
+        Args:
+            now: Current time in seconds since the epoch (defaults to the current time).
+
+        Returns:
+            A dictionary with the reply count, split replies, split rate and median latency.
+        """
+        now = time.time() if now is None else now
+        for burst in self._conversations.values():
+            if burst.due_at is not None and now >= burst.due_at:
+                self._finish(burst)
+        return {
+            "replies": self.replies,
+            "split_replies": self.split_replies,
+            "split_rate": round(self.split_replies / self.replies, 3) if self.replies else 0.0,
+            "median_reply_latency_seconds": round(statistics.median(self._latencies), 1) if self._latencies else None,
+        }
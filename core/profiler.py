@@ -0,0 +1,146 @@
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+# A frame is keyed by function name and definition site so samples of one function aggregate
+Frame = Tuple[str, str, int]
+
+
+def _frame_label(frame: Frame) -> str:
+    """Render a frame as 'function (file:line)'."""
+    return f"{frame[0]} ({frame[1]}:{frame[2]})"
+
+
+class StackSampler:
+    """
+    Statistical profiler that periodically records the stack of every Python thread.
+
+    Sampling happens in a dedicated thread which only exists while a profile is being
+    taken, so there is no overhead when no profile is running.
+    """
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval  # Seconds between samples
+        self.samples: Counter = Counter()  # (thread name, stack of frames) -> sample count
+        self.sample_count = 0
+        self.duration = 0.0
+
+    def _take_sample(self, own_thread_id: int, thread_names: Dict[int, str]) -> None:
+        """Record the current stack of every thread except the sampler itself."""
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread_id:
+                continue
+            stack: List[Frame] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            stack.reverse()  # Root frame first, as expected by collapsed-stack tools
+            thread_name = thread_names.get(thread_id, f"thread-{thread_id}")
+            self.samples[(thread_name, tuple(stack))] += 1
+        self.sample_count += 1
+
+    def run(self, seconds: float) -> "StackSampler":
+        """
+        Sample all threads for the given window. Blocks the calling thread.
+
+        Args:
+            seconds: Length of the sampling window.
+
+        Returns:
+            The sampler itself, holding the collected samples.
+        """
+        own_thread_id = threading.get_ident()
+        start = time.perf_counter()
+        deadline = start + seconds
+        next_sample = start
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if now >= next_sample:
+                thread_names = {t.ident: t.name for t in threading.enumerate()}
+                self._take_sample(own_thread_id, thread_names)
+                next_sample += self.interval
+                if next_sample < now:  # Fell behind; don't burst to catch up
+                    next_sample = now + self.interval
+            time.sleep(max(0.0, min(next_sample, deadline) - time.perf_counter()))
+        self.duration = time.perf_counter() - start
+        return self
+
+    def collapsed(self) -> str:
+        """Render samples in Brendan Gregg's collapsed-stack format (input for flamegraph.pl)."""
+        lines = [
+            ";".join([thread_name] + [_frame_label(frame) for frame in stack]) + f" {count}"
+            for (thread_name, stack), count in self.samples.most_common()
+        ]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def speedscope(self, name: str = "profile") -> Dict[str, Any]:
+        """Render samples as a speedscope JSON document with one sampled profile per thread."""
+        frames: List[Dict[str, Any]] = []
+        frame_index: Dict[Frame, int] = {}
+        profiles: Dict[str, Dict[str, Any]] = {}
+
+        for (thread_name, stack), count in self.samples.items():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indexes.append(frame_index[frame])
+
+            profile = profiles.setdefault(thread_name, {
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.duration,
+                "samples": [],
+                "weights": [],
+            })
+            profile["samples"].append(indexes)
+            profile["weights"].append(count * self.interval)
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "fit-insta-demo-server",
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+        }
+
+
+# Only one profile per process at a time; concurrent samplers would skew each other
+PROFILE_LOCK = threading.Lock()
+
+
+def sample_profile(seconds: float, interval: float, output_format: str = "collapsed", name: str = "profile"):
+    """
+    Take a profile of every thread in this process and render it.
+
+    Args:
+        seconds: Length of the sampling window.
+        interval: Seconds between samples.
+        output_format: 'collapsed' for collapsed stacks or 'speedscope' for speedscope JSON.
+        name: Name recorded in the speedscope document.
+
+    Returns:
+        The collapsed-stack text or the speedscope document.
+
+    Raises:
+        ValueError: If the output format is unknown.
+        RuntimeError: If another profile is already running in this process.
+    """
+    if output_format not in ("collapsed", "speedscope"):
+        raise ValueError(f"Unknown profile format: {output_format}")
+    if not PROFILE_LOCK.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        sampler = StackSampler(interval).run(seconds)
+    finally:
+        PROFILE_LOCK.release()
+    if output_format == "speedscope":
+        return sampler.speedscope(name)
+    return sampler.collapsed()
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)  # Ensure logger is defined
+
+EventHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class LocalEventBus:
+    """
+    In-process event bus used when no shared pub/sub backend is configured.
+
+    Events only reach the SSE subscribers of the worker that received the webhook,
+    which matches the behaviour of a single uvicorn worker.
+    """
+    def __init__(self, deliver: EventHandler):
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._deliver = deliver  # Hands events to this worker's SSE subscribers
+
+    async def start(self) -> None:
+        """Nothing to relay for the in-process bus."""
+
+    async def publish(self, event: Dict[str, Any]) -> None:
+        """Deliver an event to the local subscribers."""
+        await self._deliver(event)
+
+    async def stop(self) -> None:
+        """Nothing to release for the in-process bus."""
+
+
+class RedisEventBus(LocalEventBus):
+    """
+    Event bus backed by Redis pub/sub so every web worker sees every webhook event.
+
+    The worker that receives a webhook delivers it locally and publishes it once on the
+    channel; a background relay on each worker forwards events published by *other*
+    workers to its own SSE subscribers.
+    """
+    def __init__(self, url: str, channel: str, deliver: EventHandler):
+        super().__init__(deliver)
+        import redis.asyncio as aioredis  # Optional dependency, only needed for this backend
+
+        self.url = url
+        self.channel = channel
+        self._redis = aioredis.from_url(url)
+        self._relay_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Start relaying events published by other workers."""
+        self._relay_task = asyncio.create_task(self._relay())
+        logger.info(f"Event bus relaying channel '{self.channel}' as worker {self.worker_id}")
+
+    async def publish(self, event: Dict[str, Any]) -> None:
+        """Deliver an event locally, then broadcast it to the other workers."""
+        await super().publish(event)
+        message = json.dumps({"origin": self.worker_id, "event": event})
+        try:
+            await self._redis.publish(self.channel, message)
+        except Exception as e:
+            logger.error(f"Failed to publish event to channel '{self.channel}': {e}")
+
+    async def handle_message(self, raw_message: Any) -> None:
+        """Forward a message received from the channel, skipping events this worker published."""
+        try:
+            message = json.loads(raw_message)
+        except (TypeError, json.JSONDecodeError) as e:
+            logger.error(f"Discarding malformed event bus message: {e}")
+            return
+        if message.get("origin") == self.worker_id:
+            return  # Already delivered locally in publish()
+        await self._deliver(message["event"])
+
+    async def _relay(self) -> None:
+        """Subscribe to the channel and relay messages, reconnecting after failures."""
+        backoff = 1
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                backoff = 1
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        await self.handle_message(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event bus relay lost connection: {e}. Retrying in {backoff}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def stop(self) -> None:
+        """Stop the relay task and close the Redis connection."""
+        if self._relay_task is not None:
+            self._relay_task.cancel()
+            try:
+                await self._relay_task
+            except asyncio.CancelledError:
+                pass
+            self._relay_task = None
+        await self._redis.aclose()
+
+
+def create_event_bus(url: str, channel: str, deliver: EventHandler) -> LocalEventBus:
+    """
+    Create the event bus for the configured pub/sub URL.
+
+    Args:
+        url: 'memory://' for the in-process fallback, or a redis:// / rediss:// URL.
+        channel: The pub/sub channel webhook events are published on.
+        deliver: Coroutine that stores an event and pushes it to this worker's SSE clients.
+
+    Returns:
+        An event bus instance exposing start(), publish() and stop().
+    """
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisEventBus(url, channel, deliver)
+    if url != "memory://":
+        logger.warning(f"Unsupported event pub/sub URL '{url}'. Falling back to in-process delivery.")
+    return LocalEventBus(deliver)
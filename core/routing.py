@@ -0,0 +1,135 @@
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+# Celery queues ("lanes") that keep DMs, comment replies and unhappy users apart
+DM_LANE = "dm"
+COMMENT_LANE = "comments"
+ESCALATION_LANE = "escalations"
+LANES = (ESCALATION_LANE, DM_LANE, COMMENT_LANE)
+
+# Redis transport semantics: 0 is the highest priority, 9 the lowest
+MAX_PRIORITY = 9
+
+
+class LaneRouter:
+    """
+    Decides which Celery queue and priority a reply task is sent with, and how long to defer it.
+
+    Negative-sentiment items go to the escalation lane, everything else to the DM or
+    comment lane. Within a lane, an account whose recent (weighted) load is at least twice
+    the average of the other active accounts is deferred by defer_step seconds per doubling,
+    so one busy account cannot starve the others while evenly matched accounts are not delayed.
+
+    Fairness is applied as extra countdown rather than message priority: reply tasks carry
+    an eta, and workers reserve eta tasks early and run them in due-time order, so broker
+    priority never decides which of them runs first.
+    """
+    def __init__(
+        self,
+        lane_priorities: Dict[str, int],
+        escalation_threshold: float,
+        account_weights: Optional[Dict[str, float]] = None,
+        defer_step: float = 30,
+        half_life: float = 60,
+    ):
+        self.lane_priorities = lane_priorities
+        self.escalation_threshold = escalation_threshold  # VADER compound score at or below which we escalate
+        self.account_weights = account_weights or {}
+        self.defer_step = defer_step  # Seconds of extra countdown per doubling over the fair share
+        self.half_life = half_life  # Seconds for an account's recent load to decay by half
+
+        self._load: Dict[str, Dict[str, float]] = {lane: {} for lane in LANES}
+        self._updated_at: Dict[str, float] = {lane: 0.0 for lane in LANES}
+
+    def lane_for(self, kind: str, sentiment_score: float) -> str:
+        """
+        Pick the lane for a reply.
+
+        Args:
+            kind: 'direct_message' or 'comment'.
+            sentiment_score: VADER compound score of the text being replied to.
+
+        Returns:
+            The name of the Celery queue to use.
+        """
+        if sentiment_score <= self.escalation_threshold:
+            return ESCALATION_LANE
+        return DM_LANE if kind == "direct_message" else COMMENT_LANE
+
+    def _decay(self, lane: str, now: float) -> Dict[str, float]:
+        load = self._load[lane]
+        factor = 0.5 ** (max(0.0, now - self._updated_at[lane]) / self.half_life)
+        self._updated_at[lane] = now
+        for account_id in list(load):
+            load[account_id] *= factor
+            if load[account_id] < 0.01:
+                del load[account_id]  # Idle accounts drop out of the fair-share calculation
+        return load
+
+    def route(self, kind: str, sentiment_score: float, account_id: str, now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Choose queue, priority and fair-share deferral for a task and account for it in the fair-share load.
+
+        Args:
+            kind: 'direct_message' or 'comment'.
+            sentiment_score: VADER compound score of the text being replied to.
+            account_id: The Instagram account the reply is sent from.
+            now: Current time in seconds since the epoch (defaults to the current time).
+
+        Returns:
+            A dictionary with 'queue' and 'priority' for apply_async, and 'defer', extra seconds to add to the countdown.
+        """
+        now = time.time() if now is None else now
+        lane = self.lane_for(kind, sentiment_score)
+        load = self._decay(lane, now)
+
+        # Compare the account's recent load (before this task) with the other active accounts'
+        # average; defer by one step for each doubling at or beyond twice that share
+        previous_load = load.get(account_id, 0.0)
+        others = [other_load for other_id, other_load in load.items() if other_id != account_id]
+        fair_share = sum(others) / len(others) if others else 0.0
+        overshoot = previous_load / fair_share if fair_share else 1.0
+        steps = int(math.log2(overshoot)) if overshoot >= 2 else 0
+
+        weight = self.account_weights.get(account_id, 1.0)
+        load[account_id] = previous_load + 1.0 / weight
+
+        priority = min(self.lane_priorities.get(lane, 0), MAX_PRIORITY)
+        return {"queue": lane, "priority": priority, "defer": steps * self.defer_step}
+
+
+class QueueWaitTracker:
+    """Keeps recent queue-wait samples (due time to task start) per lane."""
+    def __init__(self, max_samples: int = 1000):
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()  # Thread pools run tasks concurrently (prefork children each keep their own tracker)
+        self.max_samples = max_samples
+
+    def record(self, lane: str, wait_seconds: float) -> None:
+        """Record how long a task waited in its lane after becoming due."""
+        with self._lock:
+            self._samples.setdefault(lane, deque(maxlen=self.max_samples)).append(max(0.0, wait_seconds))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Summarise recent queue waits.
+
+        Returns:
+            Per lane: sample count and p50/p95/max wait in seconds.
+        """
+        with self._lock:
+            samples = {lane: sorted(waits) for lane, waits in self._samples.items()}
+        summary = {}
+        for lane, waits in samples.items():
+            if not waits:
+                continue
+            summary[lane] = {
+                "count": len(waits),
+                "p50": round(waits[int(0.50 * (len(waits) - 1))], 3),
+                "p95": round(waits[int(0.95 * (len(waits) - 1))], 3),
+                "max": round(waits[-1], 3),
+            }
+        return summary
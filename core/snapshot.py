@@ -0,0 +1,116 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)  # Ensure logger is defined
+
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(path: str, replies: List[Dict[str, Any]]) -> str:
+    """
+    Write pending replies to a gzipped JSON snapshot of this process.
+
+    Each web worker writes its own file (path.<pid>), so workers shutting down together
+    never overwrite each other's replies; claim_snapshot collects them all.
+
+    Args:
+        path: Snapshot file path prefix.
+        replies: Pending reply entries, each with at least 'task', 'args' and 'due_at'.
+
+    Returns:
+        The path of the written snapshot file.
+    """
+    data = {"version": SNAPSHOT_VERSION, "saved_at": time.time(), "replies": replies}
+
+    worker_path = f"{path}.{os.getpid()}"
+    tmp_path = f"{worker_path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, worker_path)  # Atomic, so a crash mid-write never leaves a truncated snapshot
+    return worker_path
+
+
+def claim_snapshot(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Load and remove the snapshots of all web workers so that only one worker restores each of them.
+
+    Args:
+        path: Snapshot file path prefix.
+
+    Returns:
+        The merged snapshot data, or None if there is no (readable) snapshot.
+    """
+    prefix = f"{path}."
+    worker_paths = [
+        worker_path for worker_path in glob.glob(f"{glob.escape(path)}.*")
+        if worker_path[len(prefix):].isdigit()  # Skip other workers' .tmp and .restoring files
+    ]
+    replies, claimed = [], False
+    for worker_path in sorted(worker_paths):
+        claimed_path = f"{worker_path}.{os.getpid()}.restoring"
+        try:
+            os.rename(worker_path, claimed_path)  # Only one worker wins the rename
+        except FileNotFoundError:
+            continue
+        try:
+            data = _read(claimed_path)
+        finally:
+            os.remove(claimed_path)
+        if data:
+            replies.extend(data["replies"])
+            claimed = True
+    if not claimed:
+        return None
+    return {"version": SNAPSHOT_VERSION, "replies": replies}
+
+
+def _read(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f"Ignoring unreadable snapshot {path}: {e}")
+        return None
+    if data.get("version") != SNAPSHOT_VERSION:
+        logger.error(f"Ignoring snapshot {path} with unsupported version {data.get('version')}")
+        return None
+    return data
+
+
+def spread_due_times(replies: List[Dict[str, Any]], now: float, spread_seconds: float) -> List[Dict[str, Any]]:
+    """
+    Compute new delays for restored replies without sending the overdue backlog all at once.
+
+    Replies still in the future keep their remaining countdown. Replies that fell due while
+    the server was down are spaced evenly over spread_seconds, oldest first, and replies
+    past their expiry are dropped.
+
+    Args:
+        replies: Snapshot entries with 'due_at' and 'expires_after'.
+        now: Current time in seconds since the epoch.
+        spread_seconds: Window over which overdue replies are spread.
+
+    Returns:
+        The entries to reschedule, each with a 'delay' in seconds.
+    """
+    scheduled, overdue = [], []
+    for reply in replies:
+        if reply["due_at"] + reply["expires_after"] < now:
+            logger.warning(f"Dropping expired {reply['task']} reply that was due at {reply['due_at']:.0f}")
+        elif reply["due_at"] > now:
+            scheduled.append(dict(reply, delay=reply["due_at"] - now))
+        else:
+            overdue.append(reply)
+
+    overdue.sort(key=lambda reply: reply["due_at"])
+    step = spread_seconds / len(overdue) if overdue else 0
+    for index, reply in enumerate(overdue):
+        scheduled.append(dict(reply, delay=1 + index * step))
+    return scheduled
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)  # Ensure logger is defined
+
+# Upper bounds (milliseconds) of the lag histogram buckets; the last bucket is unbounded
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LoopStallError(AssertionError):
+    """Raised in strict mode when the event loop stalled for longer than allowed."""
+
+
+class LoopWatchdog:
+    """
+    Measures event-loop scheduling lag and reports what blocked the loop.
+
+    A heartbeat coroutine sleeps for `interval` and records how late it wakes up into a
+    histogram. A monitor thread watches the heartbeat; when it is overdue by more than
+    `stall_threshold` the loop is blocked right now, so the monitor captures the loop
+    thread's stack and logs the blocking call site.
+
+    In strict mode (strict_stall set) every stall longer than strict_stall is kept, and
+    stop() raises LoopStallError listing them. Meant for tests.
+    """
+    def __init__(
+        self,
+        interval: float = 0.1,
+        stall_threshold: float = 0.1,
+        strict_stall: Optional[float] = None,
+        on_lag: Optional[Callable[[float], None]] = None,
+    ):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.strict_stall = strict_stall
+        self.on_lag = on_lag  # Called with every lag measurement (seconds)
+
+        self._reset()
+
+        self._loop_thread_id: Optional[int] = None
+        self._beat_at = 0.0
+        self._captured_stack: Optional[str] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._monitor: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def _reset(self) -> None:
+        self.bucket_counts = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.lag_sum = 0.0
+        self.lag_count = 0
+        self.stalls = 0
+        self.violations: List[Tuple[float, str]] = []  # (lag in seconds, captured stack) in strict mode
+
+    def start(self) -> None:
+        """
+        Start watching the running event loop. Must be called from a coroutine on that loop.
+
+        Measurements and strict-mode violations from a previous run are cleared, so one stalled
+        app lifespan does not fail the next one.
+        """
+        self._reset()
+        self._loop_thread_id = threading.get_ident()
+        self._beat_at = time.perf_counter()
+        self._stopped.clear()
+        self._heartbeat = asyncio.create_task(self._beat())
+        self._monitor = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._monitor.start()
+
+    async def stop(self) -> None:
+        """
+        Stop watching.
+
+        Raises:
+            LoopStallError: In strict mode, if any stall exceeded strict_stall.
+        """
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+        if self._monitor is not None:
+            self._monitor.join()
+        if self.violations:
+            details = "\n".join(f"--- stall of {lag * 1000:.0f}ms ---\n{stack}" for lag, stack in self.violations)
+            raise LoopStallError(f"Event loop stalled {len(self.violations)} time(s) beyond {self.strict_stall * 1000:.0f}ms:\n{details}")
+
+    async def _beat(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time()
+            await asyncio.sleep(self.interval)
+            self._record(max(0.0, loop.time() - scheduled - self.interval))
+            self._beat_at = time.perf_counter()
+            self._captured_stack = None
+
+    def _record(self, lag: float) -> None:
+        lag_ms = lag * 1000
+        index = next((i for i, bound in enumerate(LAG_BUCKETS_MS) if lag_ms <= bound), len(LAG_BUCKETS_MS))
+        self.bucket_counts[index] += 1
+        self.lag_sum += lag
+        self.lag_count += 1
+        if self.on_lag is not None:
+            self.on_lag(lag)
+
+        if lag > self.stall_threshold:
+            self.stalls += 1
+            stack = self._captured_stack or "(stack not captured)"
+            logger.warning(f"Event loop stalled for {lag_ms:.0f}ms. Blocking call site:\n{stack}")
+            if self.strict_stall is not None and lag > self.strict_stall:
+                self.violations.append((lag, stack))
+
+    def _watch(self) -> None:
+        """Monitor thread: capture the loop thread's stack while the heartbeat is overdue."""
+        while not self._stopped.wait(self.interval / 2):
+            overdue = time.perf_counter() - self._beat_at - self.interval
+            if overdue > self.stall_threshold / 2 and self._captured_stack is None:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    self._captured_stack = "".join(traceback.format_stack(frame))
+
+    def histogram(self) -> Dict[str, Any]:
+        """
+        Export lag measurements as a cumulative histogram.
+
+        Returns:
+            Bucket upper bounds in ms mapped to cumulative counts (Prometheus style), plus sum, count and stalls.
+        """
+        buckets: Dict[str, int] = {}
+        cumulative = 0
+        for bound, count in zip(list(LAG_BUCKETS_MS) + ["+Inf"], self.bucket_counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "buckets_ms": buckets,
+            "sum_seconds": round(self.lag_sum, 4),
+            "count": self.lag_count,
+            "stalls": self.stalls,
+        }
@@ -1,5 +1,5 @@
 from fastapi import FastAPI, Request, Response, HTTPException, Query, Depends
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sse_starlette.sse import EventSourceResponse
 from typing import List, Dict, Any, Optional  # Importing 'Any' and 'Optional' for type hinting
@@ -16,11 +16,23 @@ import time
 import os
 from dotenv import load_dotenv
 import requests
+import httpx
 import nltk
 from nltk.sentiment import SentimentIntensityAnalyzer
-from api_tasks.postmsg import postmsg
-from api_tasks.sendreply import sendreply
+from api_tasks.postmsg import postmsg, postmsg_async
+from api_tasks.sendreply import sendreply, sendreply_async
+from core.pubsub import create_event_bus
+from core.profiler import sample_profile
+from core.debounce import DebouncePolicy
+from core.async_worker import AsyncWorker
+from core.snapshot import save_snapshot, claim_snapshot, spread_due_times
+from core.admission import AdmissionController, TEMPLATE_ONLY, SAMPLE_SIDE_WORK, DEFER_COMMENTS
+from core.watchdog import LoopWatchdog
+from core.routing import LaneRouter, QueueWaitTracker, LANES, DM_LANE, COMMENT_LANE, ESCALATION_LANE, MAX_PRIORITY
 from celery import Celery
+from celery.signals import celeryd_init, task_prerun
+from celery.worker.control import control_command, inspect_command
+from kombu import Queue
 import random
 import configparser
 
@@ -63,6 +75,64 @@ class Config:
         self.CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", config_parser.get('celery', 'broker_url'))
         self.CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", config_parser.get('celery', 'result_backend'))
 
+        # --- Routing Section (Celery queue per lane; priority 0 is highest) ---
+        self.DM_PRIORITY = int(os.getenv("DM_PRIORITY", config_parser.get('routing', 'dm_priority')))
+        self.COMMENT_PRIORITY = int(os.getenv("COMMENT_PRIORITY", config_parser.get('routing', 'comment_priority')))
+        self.ESCALATION_PRIORITY = int(os.getenv("ESCALATION_PRIORITY", config_parser.get('routing', 'escalation_priority')))
+        self.ESCALATION_THRESHOLD = float(os.getenv("ESCALATION_THRESHOLD", config_parser.get('routing', 'escalation_threshold')))
+        self.DM_CONCURRENCY = int(os.getenv("DM_CONCURRENCY", config_parser.get('routing', 'dm_concurrency')))
+        self.COMMENT_CONCURRENCY = int(os.getenv("COMMENT_CONCURRENCY", config_parser.get('routing', 'comment_concurrency')))
+        self.ESCALATION_CONCURRENCY = int(os.getenv("ESCALATION_CONCURRENCY", config_parser.get('routing', 'escalation_concurrency')))
+        self.FAIR_SHARE_DEFER_STEP = float(os.getenv("FAIR_SHARE_DEFER_STEP", config_parser.get('routing', 'fair_share_defer_step')))
+        account_weights_json_str = os.getenv("ACCOUNT_WEIGHTS", config_parser.get('routing', 'account_weights_json'))
+        try:
+            self.ACCOUNT_WEIGHTS: Dict[str, float] = json.loads(account_weights_json_str)
+        except json.JSONDecodeError:
+            self.ACCOUNT_WEIGHTS: Dict[str, float] = {}
+            logger.error("Failed to parse ACCOUNT_WEIGHTS as JSON. All accounts get equal weight.")
+
+        # --- Async Worker Section (asyncio executor for the I/O-bound reply tasks) ---
+        self.ASYNC_WORKER_CONCURRENCY = int(os.getenv("ASYNC_WORKER_CONCURRENCY", config_parser.get('async_worker', 'concurrency')))
+        self.ASYNC_WORKER_PREFETCH = int(os.getenv("ASYNC_WORKER_PREFETCH", config_parser.get('async_worker', 'prefetch')))
+        self.ASYNC_WORKER_QUEUES = os.getenv("ASYNC_WORKER_QUEUES", config_parser.get('async_worker', 'queues'))
+        self.ASYNC_HTTP_TIMEOUT = float(os.getenv("ASYNC_HTTP_TIMEOUT", config_parser.get('async_worker', 'http_timeout')))
+
+        # --- Warm Restart Section (pending replies survive deploys and restarts) ---
+        self.SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", config_parser.get('warm_restart', 'snapshot_file'))
+        self.RESTORE_SPREAD_SECONDS = float(os.getenv("RESTORE_SPREAD_SECONDS", config_parser.get('warm_restart', 'restore_spread_seconds')))
+
+        # --- Admission Section (load shedding on /webhook under overload) ---
+        self.ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", config_parser.get('admission', 'max_queue_depth')))
+        self.ADMISSION_MAX_LOOP_LAG_MS = float(os.getenv("ADMISSION_MAX_LOOP_LAG_MS", config_parser.get('admission', 'max_loop_lag_ms')))
+        self.ADMISSION_MAX_ERROR_RATE = float(os.getenv("ADMISSION_MAX_ERROR_RATE", config_parser.get('admission', 'max_error_rate')))
+        self.ADMISSION_ACK_BUDGET_MS = float(os.getenv("ADMISSION_ACK_BUDGET_MS", config_parser.get('admission', 'ack_budget_ms')))
+        self.ADMISSION_COOLDOWN_SECONDS = float(os.getenv("ADMISSION_COOLDOWN_SECONDS", config_parser.get('admission', 'cooldown_seconds')))
+        self.ADMISSION_SAMPLE_KEEP_EVERY = int(os.getenv("ADMISSION_SAMPLE_KEEP_EVERY", config_parser.get('admission', 'sample_keep_every')))
+        self.ADMISSION_COMMENT_DEFER_SECONDS = float(os.getenv("ADMISSION_COMMENT_DEFER_SECONDS", config_parser.get('admission', 'comment_defer_seconds')))
+
+        # --- Watchdog Section (event-loop lag; strict_stall_ms > 0 fails shutdown on stalls, for tests) ---
+        self.WATCHDOG_INTERVAL_MS = float(os.getenv("WATCHDOG_INTERVAL_MS", config_parser.get('watchdog', 'interval_ms')))
+        self.WATCHDOG_STALL_THRESHOLD_MS = float(os.getenv("WATCHDOG_STALL_THRESHOLD_MS", config_parser.get('watchdog', 'stall_threshold_ms')))
+        self.WATCHDOG_STRICT_STALL_MS = float(os.getenv("WATCHDOG_STRICT_STALL_MS", config_parser.get('watchdog', 'strict_stall_ms')))
+
+        # --- Events Section (SSE fan-out across web workers) ---
+        self.EVENTS_PUBSUB_URL = os.getenv("EVENTS_PUBSUB_URL", config_parser.get('events', 'pubsub_url'))
+        self.EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", config_parser.get('events', 'channel'))
+
+        # --- Debug Section (on-demand profiling, disabled while the token is empty) ---
+        self.PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", config_parser.get('debug', 'profile_token'))
+        self.PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", config_parser.get('debug', 'profile_max_seconds')))
+        self.PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", config_parser.get('debug', 'profile_interval_ms')))
+
+        # --- Debounce Section (seconds; quiet period before replying to a burst of DMs) ---
+        self.DEBOUNCE_MIN_DELAY = float(os.getenv("DEBOUNCE_MIN_DELAY", config_parser.get('debounce', 'min_delay')))
+        self.DEBOUNCE_MAX_DELAY = float(os.getenv("DEBOUNCE_MAX_DELAY", config_parser.get('debounce', 'max_delay')))
+        self.DEBOUNCE_MAX_TOTAL_WAIT = float(os.getenv("DEBOUNCE_MAX_TOTAL_WAIT", config_parser.get('debounce', 'max_total_wait')))
+        self.DEBOUNCE_DEFAULT_DELAY = float(os.getenv("DEBOUNCE_DEFAULT_DELAY", config_parser.get('debounce', 'default_delay')))
+        self.DEBOUNCE_GAP_QUANTILE = float(os.getenv("DEBOUNCE_GAP_QUANTILE", config_parser.get('debounce', 'gap_quantile')))
+        self.DEBOUNCE_MARGIN = float(os.getenv("DEBOUNCE_MARGIN", config_parser.get('debounce', 'margin')))
+        self.DEBOUNCE_SPLIT_WINDOW = float(os.getenv("DEBOUNCE_SPLIT_WINDOW", config_parser.get('debounce', 'split_window')))
+
         # --- Default Responses Section ---
         self.DEFAULT_DM_RESPONSE_POSITIVE = os.getenv("DEFAULT_DM_RESPONSE_POSITIVE", config_parser.get('defaults', 'dm_response_positive'))
         self.DEFAULT_DM_RESPONSE_NEGATIVE = os.getenv("DEFAULT_DM_RESPONSE_NEGATIVE", config_parser.get('defaults', 'dm_response_negative'))
@@ -135,11 +205,60 @@ celery.conf.update(
     result_serializer='json',
     timezone='UTC',  # Set a consistent timezone
     enable_utc=True,
-    broker_connection_retry_on_startup=True
+    broker_connection_retry_on_startup=True,
+    task_track_started=True,  # Lets the shutdown snapshot tell running replies from ones still waiting
+    # One queue per lane; workers started without -Q consume all of them
+    task_queues=[Queue(lane) for lane in LANES] + [Queue('celery')],
+    # Redis transport: priority_steps splits each queue by message priority (0 = highest), and
+    # queue_order_strategy='priority' makes a worker consuming several lanes drain them in the order
+    # they are listed (escalations first) instead of round robin. Both only order messages that are
+    # due; eta tasks are reserved early and run by due time.
+    broker_transport_options={'queue_order_strategy': 'priority', 'priority_steps': list(range(MAX_PRIORITY + 1))},
+)
+
+LANE_CONCURRENCY: Dict[str, int] = {
+    DM_LANE: config.DM_CONCURRENCY,
+    COMMENT_LANE: config.COMMENT_CONCURRENCY,
+    ESCALATION_LANE: config.ESCALATION_CONCURRENCY,
+}
+
+# Picks the lane and priority of each reply task, deferring accounts well over their weighted fair share
+lane_router = LaneRouter(
+    lane_priorities={
+        DM_LANE: config.DM_PRIORITY,
+        COMMENT_LANE: config.COMMENT_PRIORITY,
+        ESCALATION_LANE: config.ESCALATION_PRIORITY,
+    },
+    escalation_threshold=config.ESCALATION_THRESHOLD,
+    account_weights=config.ACCOUNT_WEIGHTS,
+    defer_step=config.FAIR_SHARE_DEFER_STEP,
+)
+queue_waits = QueueWaitTracker()  # Filled in by workers as tasks start
+
+# Degrades /webhook work step by step when the server is overloaded
+admission = AdmissionController(
+    max_queue_depth=config.ADMISSION_MAX_QUEUE_DEPTH,
+    max_loop_lag=config.ADMISSION_MAX_LOOP_LAG_MS / 1000,
+    max_error_rate=config.ADMISSION_MAX_ERROR_RATE,
+    ack_budget=config.ADMISSION_ACK_BUDGET_MS / 1000,
+    cooldown=config.ADMISSION_COOLDOWN_SECONDS,
+    sample_keep_every=config.ADMISSION_SAMPLE_KEEP_EVERY,
 )
 
 message_queue: Dict[str, List[Dict[str, Any]]] = {}  # Store messages per conversation_id
 conversation_task_schedules: Dict[str, str] = {}  # Track scheduled task IDs per conversation
+pending_replies: Dict[str, Dict[str, Any]] = {}  # Scheduled reply tasks by task ID, snapshotted on shutdown
+
+# Learns typing gaps per conversation/account to pick how long to batch DMs before replying
+dm_debounce = DebouncePolicy(
+    min_delay=config.DEBOUNCE_MIN_DELAY,
+    max_delay=config.DEBOUNCE_MAX_DELAY,
+    max_total_wait=config.DEBOUNCE_MAX_TOTAL_WAIT,
+    default_delay=config.DEBOUNCE_DEFAULT_DELAY,
+    gap_quantile=config.DEBOUNCE_GAP_QUANTILE,
+    margin=config.DEBOUNCE_MARGIN,
+    split_window=config.DEBOUNCE_SPLIT_WINDOW,
+)
 
 
 def startup_event():
@@ -160,8 +279,152 @@ def startup_event():
 startup_event()
 
 
+@celeryd_init.connect
+def configure_lane_concurrency(sender=None, conf=None, options=None, **kwargs):
+    """Use the configured concurrency for a worker dedicated to one lane, unless -c was given."""
+    queues = options.get('queues') or []
+    if isinstance(queues, str):
+        queues = queues.split(',')
+    if len(queues) == 1 and queues[0] in LANE_CONCURRENCY and not options.get('concurrency'):
+        conf.worker_concurrency = LANE_CONCURRENCY[queues[0]]
+        logger.info(f"Worker {sender} consuming lane '{queues[0]}' with concurrency {conf.worker_concurrency}")
+
+
+def record_lane_wait(task_id: str, lane: Optional[str], due_at: Optional[float]):
+    """Record how long a reply task waited in its lane after it became due."""
+    if lane and due_at:
+        wait = time.time() - due_at
+        queue_waits.record(lane, wait)
+        logger.info(f"Task {task_id} waited {wait:.3f}s in lane '{lane}'")
+
+
+@task_prerun.connect
+def record_queue_wait(task_id=None, task=None, **kwargs):
+    """Record queue wait for tasks run by the regular Celery worker."""
+    record_lane_wait(task_id, getattr(task.request, 'lane', None), getattr(task.request, 'due_at', None))
+
+
+@inspect_command()
+def queue_wait(state) -> Dict[str, Any]:
+    """
+    Queue-wait percentiles per lane on this worker.
+
+    Waits are recorded by task_prerun in the process that runs the task. Under the prefork
+    pool that is a pool child, while this command is answered by the parent process, so it
+    only reports waits for the threads and solo pools and for the async worker.
+    """
+    pool = getattr(getattr(state, 'consumer', None), 'pool', None)
+    if pool is not None and type(pool).__module__ == 'celery.concurrency.prefork':
+        return {'error': 'queue waits are recorded in prefork pool children; run the worker with -P threads or -P solo'}
+    return queue_waits.snapshot()
+
+
+def schedule_reply(task, args: tuple, delay: float, expires_after: float, kind: str, score: float, account_id: str,
+                   kwargs: Optional[Dict[str, Any]] = None, defer_low_priority: float = 0):
+    """
+    Schedule a reply task on the lane and priority chosen by the lane router, deferred if the account is over its fair share.
+
+    Args:
+        task: The Celery task to schedule (send_dm or send_delayed_reply).
+        args: Positional arguments for the task.
+        delay: Seconds until the task becomes due.
+        expires_after: Seconds after the due time at which the task expires.
+        kind: 'direct_message' or 'comment'.
+        score: VADER compound score of the user's text, used to detect escalations.
+        account_id: The Instagram account the reply is sent from.
+        kwargs: Optional keyword arguments for the task.
+        defer_low_priority: Extra delay in seconds if the reply lands in the comment lane (load shedding).
+
+    Returns:
+        The AsyncResult of the scheduled task.
+    """
+    route = lane_router.route(kind, score, account_id)
+    delay += route.pop("defer")  # Busy accounts wait longer; countdown tasks ignore broker priority
+    if defer_low_priority and route["queue"] == COMMENT_LANE:
+        delay += defer_low_priority
+        admission.record_shed("comment_replies_deferred")
+    due_at = time.time() + delay
+    result = task.apply_async(
+        args=args,
+        kwargs=kwargs,
+        countdown=delay, expires=delay + expires_after,
+        headers={"lane": route["queue"], "due_at": due_at},  # Used to measure queue wait
+        **route
+    )
+
+    # Remember the reply until it expires so it can be snapshotted on shutdown if it has not run yet
+    now = time.time()
+    for task_id in [task_id for task_id, reply in pending_replies.items() if reply["due_at"] + reply["expires_after"] < now]:
+        del pending_replies[task_id]
+    if task.name == "send_dm":
+        args = (args[0], {}, args[2])  # Messages are read from message_queue when snapshotting
+    pending_replies[result.id] = {
+        "task": task.name, "args": list(args), "kwargs": kwargs or {}, "due_at": due_at, "expires_after": expires_after,
+        "kind": kind, "score": score, "account_id": account_id,
+    }
+    return result
+
+
+def prepare_dm_reply(messages: List[Dict[str, Any]]) -> tuple:
+    """
+    Combine a conversation's queued messages into the LLM prompt.
+
+    Args:
+        messages: The queued direct message events of one conversation.
+
+    Returns:
+        A tuple of (recipient_id, sentiment, full_prompt).
+    """
+    recipient_id = messages[0]["sender_id"]
+    combined_text = "\n".join([msg["text"] for msg in messages])
+
+    sentiment = analyze_sentiment(combined_text)  # Analyze sentiment BEFORE LLM call
+    logger.info(f"Sentiment Analysis Result: Sentiment: {sentiment}, Combined Text: '{combined_text}'")
+
+    if sentiment == "Positive":
+        llm_prompt_suffix = "Respond with a very enthusiastic and thankful tone, acknowledging the compliment. Keep it concise and friendly."
+    elif sentiment == "Negative":
+        llm_prompt_suffix = "Respond with an apologetic and helpful tone, asking for more details about the issue so we can improve. Keep it concise and professional."
+    else: # Neutral or mixed sentiment
+        llm_prompt_suffix = "Respond in a helpful and neutral tone. Keep it concise and informative."
+
+    system_prompt_content = ""
+    with open("collection_system_prompt/system_prompt.txt", "r") as file:
+        system_prompt_content = file.read().strip()
+    full_prompt = system_prompt_content + " Message/Conversation input from user: " + combined_text + " "
+    return recipient_id, sentiment, full_prompt
+
+
+def queued_messages(conversation_id_to_process: str, message_queue_snapshot: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Return the conversation's messages from a send_dm snapshot (empty if there is nothing to answer)."""
+    messages = message_queue_snapshot.get(conversation_id_to_process) or []
+    if not messages:
+        logger.info(f"No messages to process for conversation: {conversation_id_to_process}. Task exiting.")
+    return messages
+
+
+def default_dm_response(sentiment: str) -> str:
+    """Default DM reply used when the LLM is skipped or fails."""
+    if sentiment == "Positive":
+        return default_dm_response_positive
+    return default_dm_response_negative
+
+
+def clear_conversation(conversation_id_to_process: str):
+    """Clear the queued messages and task schedule of a conversation once it has been answered."""
+    if conversation_id_to_process in message_queue:  # Double check before deleting (race condition safety)
+        del message_queue[conversation_id_to_process]
+        logger.info(f"Cleared message queue for conversation: {conversation_id_to_process}")
+    else:
+        logger.warning(f"Conversation ID {conversation_id_to_process} not found in message_queue during clear. Possible race condition.")
+
+    # Clear task schedule after successful processing
+    if conversation_id_to_process in conversation_task_schedules:
+        del conversation_task_schedules[conversation_id_to_process]
+
+
 @celery.task(name="send_dm")
-def send_dm(conversation_id_to_process: str, message_queue_snapshot: Dict[str, List[Dict[str, Any]]], account_id_to_use: str) -> Dict[str, Any]:
+def send_dm(conversation_id_to_process: str, message_queue_snapshot: Dict[str, List[Dict[str, Any]]], account_id_to_use: str, template_only: bool = False) -> Dict[str, Any]:
     """
     Celery task to process and respond to a conversation's messages.
 
@@ -169,43 +432,26 @@ def send_dm(conversation_id_to_process: str, message_queue_snapshot: Dict[str, L
         conversation_id_to_process: The ID of the conversation to process.
         message_queue_snapshot: A snapshot of the message queue for processing.
         account_id_to_use: The Instagram account ID to use for sending the response.
+        template_only: Reply with the default response instead of calling the LLM (set under overload).
 
     Returns:
         A dictionary indicating the task status and processed conversation details.
     """
     try:
-        if conversation_id_to_process not in message_queue_snapshot or not message_queue_snapshot[conversation_id_to_process]:
-            logger.info(f"No messages to process for conversation: {conversation_id_to_process}. Task exiting.")
+        messages = queued_messages(conversation_id_to_process, message_queue_snapshot)  # Use the snapshot to avoid race conditions
+        if not messages:
             return {"status": "no_messages_to_process", "conversation_id": conversation_id_to_process}
+        recipient_id, sentiment, full_prompt = prepare_dm_reply(messages)
 
-        messages = message_queue_snapshot[conversation_id_to_process]  # Use the snapshot to avoid race conditions
-        recipient_id = messages[0]["sender_id"]
-        combined_text = "\n".join([msg["text"] for msg in messages])
-
-        sentiment = analyze_sentiment(combined_text)  # Analyze sentiment BEFORE LLM call
-        logger.info(f"Sentiment Analysis Result: Sentiment: {sentiment}, Combined Text: '{combined_text}'")
-
-        if sentiment == "Positive":
-            llm_prompt_suffix = "Respond with a very enthusiastic and thankful tone, acknowledging the compliment. Keep it concise and friendly."
-        elif sentiment == "Negative":
-            llm_prompt_suffix = "Respond with an apologetic and helpful tone, asking for more details about the issue so we can improve. Keep it concise and professional."
-        else: # Neutral or mixed sentiment
-            llm_prompt_suffix = "Respond in a helpful and neutral tone. Keep it concise and informative."
-
-        system_prompt_content = ""
-        with open("collection_system_prompt/system_prompt.txt", "r") as file:
-            system_prompt_content = file.read().strip()
-        full_prompt = system_prompt_content + " Message/Conversation input from user: " + combined_text + " "
-
-        # Generate response using LLM
-        try:
-            response_text = llm_response(gemini_api_key, model_name, full_prompt)
-        except Exception as e:
-            logger.error(f"Error generating LLM response: {e}")
-            if sentiment == "Positive":
-                response_text = default_dm_response_positive
-            else:
-                response_text = default_dm_response_negative
+        # Generate response using LLM (skipped in template-only mode under overload)
+        response_text = None
+        if not template_only:
+            try:
+                response_text = llm_response(gemini_api_key, model_name, full_prompt)
+            except Exception as e:
+                logger.error(f"Error generating LLM response: {e}")
+        if response_text is None:
+            response_text = default_dm_response(sentiment)
 
         # Send the combined response
         try:
@@ -216,15 +462,7 @@ def send_dm(conversation_id_to_process: str, message_queue_snapshot: Dict[str, L
             logger.error(f"Error sending message to {recipient_id} using account {account_id_to_use}: {e}")
 
         # Clear ONLY for the processed conversation ID (after successful processing)
-        if conversation_id_to_process in message_queue:  # Double check before deleting (race condition safety)
-            del message_queue[conversation_id_to_process]
-            logger.info(f"Cleared message queue for conversation: {conversation_id_to_process}")
-        else:
-            logger.warning(f"Conversation ID {conversation_id_to_process} not found in message_queue during clear. Possible race condition.")
-
-        # Clear task schedule after successful processing
-        if conversation_id_to_process in conversation_task_schedules:
-            del conversation_task_schedules[conversation_id_to_process]
+        clear_conversation(conversation_id_to_process)
 
         return {"status": "success", "processed_conversation": conversation_id_to_process, "message_count": len(messages)}
 
@@ -257,6 +495,156 @@ def send_delayed_reply(comment_id: str, message_to_be_sent: str, account_id_to_u
         raise  # Re-raise exception for Celery retry handling.
 
 
+# --- Asyncio variants of the reply tasks, run by the async worker (python server.py async-worker) ---
+
+async_http_client: Optional[httpx.AsyncClient] = None  # Created on the async worker's event loop
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Return the shared async HTTP client, creating it on first use."""
+    global async_http_client
+    if async_http_client is None:
+        async_http_client = httpx.AsyncClient(
+            timeout=config.ASYNC_HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=config.ASYNC_WORKER_CONCURRENCY),
+        )
+    return async_http_client
+
+
+async def close_async_http_client():
+    """Close the shared async HTTP client on worker shutdown."""
+    global async_http_client
+    if async_http_client is not None:
+        await async_http_client.aclose()
+        async_http_client = None
+
+
+async def send_dm_async(conversation_id_to_process: str, message_queue_snapshot: Dict[str, List[Dict[str, Any]]], account_id_to_use: str, template_only: bool = False) -> Dict[str, Any]:
+    """
+    Coroutine version of the send_dm task with the same arguments and result.
+
+    Args:
+        conversation_id_to_process: The ID of the conversation to process.
+        message_queue_snapshot: A snapshot of the message queue for processing.
+        account_id_to_use: The Instagram account ID to use for sending the response.
+        template_only: Reply with the default response instead of calling the LLM (set under overload).
+
+    Returns:
+        A dictionary indicating the task status and processed conversation details.
+    """
+    try:
+        messages = queued_messages(conversation_id_to_process, message_queue_snapshot)
+        if not messages:
+            return {"status": "no_messages_to_process", "conversation_id": conversation_id_to_process}
+        # Sentiment scoring and the prompt file read are blocking; keep them off the event loop
+        recipient_id, sentiment, full_prompt = await asyncio.to_thread(prepare_dm_reply, messages)
+        client = get_async_http_client()
+
+        response_text = None
+        if not template_only:
+            try:
+                response_text = await llm_response_async(client, gemini_api_key, model_name, full_prompt)
+            except Exception as e:
+                logger.error(f"Error generating LLM response: {e}")
+        if response_text is None:
+            response_text = default_dm_response(sentiment)
+
+        try:
+            access_token_to_use = get_access_token_for_account(account_id_to_use)
+            result = await postmsg_async(client, access_token_to_use, recipient_id, response_text)
+            logger.info(f"Sent combined response to {recipient_id} using account {account_id_to_use}. Result: {result}")
+        except Exception as e:
+            logger.error(f"Error sending message to {recipient_id} using account {account_id_to_use}: {e}")
+
+        clear_conversation(conversation_id_to_process)
+
+        return {"status": "success", "processed_conversation": conversation_id_to_process, "message_count": len(messages)}
+
+    except Exception as e:
+        logger.error(f"Error in send_dm task for conversation {conversation_id_to_process}: {e}")
+        raise
+
+
+async def send_delayed_reply_async(comment_id: str, message_to_be_sent: str, account_id_to_use: str) -> Dict[str, Any]:
+    """
+    Coroutine version of the send_delayed_reply task with the same arguments and result.
+
+    Args:
+        comment_id: The ID of the comment to reply to.
+        message_to_be_sent: The message content to send as a reply.
+        account_id_to_use: The Instagram account ID to use for sending the reply.
+
+    Returns:
+        The response data from the Instagram reply API.
+    """
+    try:
+        access_token_to_use = get_access_token_for_account(account_id_to_use)
+        result = await sendreply_async(get_async_http_client(), access_token_to_use, comment_id, message_to_be_sent)
+        logger.info(f"Reply sent to comment {comment_id} using account {account_id_to_use}. Result: {result}")
+        return result
+    except Exception as e:
+        logger.error(f"Error sending reply to comment {comment_id} using account {account_id_to_use}: {e}")
+        raise
+
+
+ASYNC_TASK_HANDLERS = {
+    "send_dm": send_dm_async,
+    "send_delayed_reply": send_delayed_reply_async,
+}
+
+
+def run_async_worker(queues: List[str], concurrency: int):
+    """
+    Consume reply tasks from the broker and run them as coroutines on one event loop.
+
+    Args:
+        queues: Lanes to consume from.
+        concurrency: Maximum number of tasks executing at once.
+    """
+    AsyncWorker(
+        celery,
+        ASYNC_TASK_HANDLERS,
+        queues=queues,
+        concurrency=concurrency,
+        prefetch=config.ASYNC_WORKER_PREFETCH,
+        on_task_start=lambda headers: record_lane_wait(headers['id'], headers.get('lane'), headers.get('due_at')),
+        on_shutdown=close_async_http_client,
+        control_handlers={"queue_wait": queue_wait, "profile": profile},
+    ).run()
+
+
+@control_command(
+    args=[('seconds', float), ('output_format', str)],
+    signature='[seconds [output_format]]',
+    default_timeout=config.PROFILE_MAX_SECONDS + 5,
+)
+def profile(state, seconds: float = 10, output_format: str = "collapsed") -> Dict[str, Any]:
+    """
+    Celery control command that profiles a worker for a number of seconds.
+
+    Usage: celery.control.broadcast("profile", arguments={"seconds": 10}, reply=True, timeout=15)
+
+    Only the threads of the process receiving the command are sampled. Workers on the threads
+    or solo pool and the async worker run tasks in that process; under prefork the tasks run in
+    child processes, so only the parent's consumer is sampled (see the README).
+    The consumer is busy while sampling, so new tasks are not fetched during the window.
+
+    Args:
+        state: Celery worker state (unused).
+        seconds: Length of the sampling window, capped at PROFILE_MAX_SECONDS.
+        output_format: 'collapsed' or 'speedscope'.
+
+    Returns:
+        A dictionary with the rendered profile, or an error message.
+    """
+    seconds = min(max(float(seconds), 0.1), config.PROFILE_MAX_SECONDS)
+    try:
+        result = sample_profile(seconds, config.PROFILE_INTERVAL_MS / 1000, output_format, name=f"celery worker {os.getpid()}")
+    except (ValueError, RuntimeError) as e:
+        return {"error": str(e)}
+    return {"ok": result}
+
+
 def save_events_to_file():
     """Save webhook events to a JSON file for persistence."""
     with open(WEBHOOK_FILE, "w") as f:
@@ -294,7 +682,38 @@ def get_access_token_for_account(account_id: str) -> str:
     return access_token
 
 
-def llm_response(api_key: str, model_name: str, query: str) -> str:
+def build_llm_request(api_key: str, model_name: str, query: str) -> Dict[str, Any]:
+    """
+    Builds a Google Gemini generateContent request, shared by llm_response and llm_response_async.
+
+    Args:
+        api_key: API key for Google Gemini.
+        model_name: Name of the Gemini model to use.
+        query: The query/prompt to send to the LLM.
+
+    Returns:
+        The url, headers and JSON payload, as keyword arguments for an HTTP client's post().
+    """
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
+    headers = {"Content-Type": "application/json"}
+    payload = {"contents": [{"parts": [{"text": query}]}]}  # Construct payload with the query
+    return {"url": url, "headers": headers, "json": payload}
+
+
+def read_llm_response(response_json: Dict[str, Any]) -> str:
+    """
+    Extracts the generated text from a Gemini response.
+
+    Raises:
+        Exception: If the response has no candidates.
+    """
+    if 'candidates' in response_json and response_json['candidates']:
+        return response_json['candidates'][0]['content']['parts'][0]['text']
+    else:
+        raise Exception("No candidates found in the response.")
+
+
+def llm_response(api_key: str, model_name: str, query: str, timeout: Optional[float] = None) -> str:
     """
     Generates response using Google Gemini API.
 
@@ -302,6 +721,7 @@ def llm_response(api_key: str, model_name: str, query: str) -> str:
         api_key: API key for Google Gemini.
         model_name: Name of the Gemini model to use.
         query: The query/prompt to send to the LLM.
+        timeout: Seconds to wait for Gemini before giving up (no limit by default).
 
     Returns:
         The text response generated by the LLM.
@@ -309,17 +729,10 @@ def llm_response(api_key: str, model_name: str, query: str) -> str:
     Raises:
         Exception: If there's an error during the API request or response processing.
     """
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
-    headers = {"Content-Type": "application/json"}
-    payload = {"contents": [{"parts": [{"text": query}]}]}  # Construct payload with the query
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = requests.post(**build_llm_request(api_key, model_name, query), timeout=timeout)
         response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-        response_json = response.json()
-        if 'candidates' in response_json and response_json['candidates']:
-            return response_json['candidates'][0]['content']['parts'][0]['text']
-        else:
-            raise Exception("No candidates found in the response.")
+        return read_llm_response(response.json())
     except requests.exceptions.RequestException as e: # Catch specific request exceptions
         raise Exception(f"API request failed: {str(e)}")
     except json.JSONDecodeError as e: # Catch JSON decoding errors
@@ -328,6 +741,34 @@ def llm_response(api_key: str, model_name: str, query: str) -> str:
         raise Exception(f"An error occurred: {str(e)}")
 
 
+async def llm_response_async(client: httpx.AsyncClient, api_key: str, model_name: str, query: str) -> str:
+    """
+    Generates response using Google Gemini API without blocking the event loop.
+
+    Args:
+        client: Shared async HTTP client.
+        api_key: API key for Google Gemini.
+        model_name: Name of the Gemini model to use.
+        query: The query/prompt to send to the LLM.
+
+    Returns:
+        The text response generated by the LLM.
+
+    Raises:
+        Exception: If there's an error during the API request or response processing.
+    """
+    try:
+        response = await client.post(**build_llm_request(api_key, model_name, query))
+        response.raise_for_status()
+        return read_llm_response(response.json())
+    except httpx.HTTPError as e:
+        raise Exception(f"API request failed: {str(e)}")
+    except json.JSONDecodeError as e:
+        raise Exception(f"Failed to decode JSON response: {str(e)}")
+    except Exception as e:
+        raise Exception(f"An error occurred: {str(e)}")
+
+
 def parse_instagram_webhook(data: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
     Parse Instagram webhook events for both direct messages and comments.
@@ -400,6 +841,43 @@ def parse_instagram_webhook(data: Dict[str, Any]) -> List[Dict[str, Any]]:
     return results
 
 
+sentiment_analyzer: Optional[SentimentIntensityAnalyzer] = None  # Loading the VADER lexicon is slow, so it is loaded once
+
+
+def get_sentiment_analyzer() -> SentimentIntensityAnalyzer:
+    """Return the shared VADER analyzer, loading the lexicon on first use."""
+    global sentiment_analyzer
+    if sentiment_analyzer is None:
+        sentiment_analyzer = SentimentIntensityAnalyzer()
+    return sentiment_analyzer
+
+
+def sentiment_score(comment_text: str) -> float:
+    """
+    Scores text with NLTK's VADER sentiment intensity analyzer.
+
+    Args:
+        comment_text: The text to score.
+
+    Returns:
+        The VADER compound score, from -1 (most negative) to 1 (most positive).
+    """
+    return get_sentiment_analyzer().polarity_scores(comment_text)['compound']
+
+
+def sentiment_label(score: float) -> str:
+    """
+    Turns a VADER compound score into the sentiment used to pick default responses.
+
+    Args:
+        score: The VADER compound score.
+
+    Returns:
+        "Positive" if the score is above 0.25, "Negative" otherwise (neutral is considered negative).
+    """
+    return "Positive" if score > 0.25 else "Negative"
+
+
 def analyze_sentiment(comment_text: str) -> str:
     """
     Analyzes sentiment of text using NLTK's VADER sentiment intensity analyzer.
@@ -410,22 +888,132 @@ def analyze_sentiment(comment_text: str) -> str:
     Returns:
         "Positive" if the sentiment is positive, "Negative" otherwise (neutral is considered negative).
     """
-    sia = SentimentIntensityAnalyzer()
-    sentiment_scores = sia.polarity_scores(comment_text)
+    return sentiment_label(sentiment_score(comment_text))
 
-    # Determine sentiment based on compound score
-    if sentiment_scores['compound'] > 0.25:
-        sentiment = "Positive"
-    else:
-        sentiment = "Negative"  # Consider neutral as negative for default responses
 
-    return sentiment
+async def deliver_event(event_with_time: Dict[str, Any]):
+    """
+    Store an event and push it to the SSE clients connected to this worker.
+
+    Called by the event bus both for webhooks received here and for events relayed
+    from other web workers.
+
+    Args:
+        event_with_time: The timestamped webhook event to deliver.
+    """
+    WEBHOOK_EVENTS.append(event_with_time) # Add event to deque
+    for client_queue in CLIENTS:
+        await client_queue.put(event_with_time) # Put event into each client queue
+
 
+# Pub/sub transport so SSE subscribers on every web worker see every webhook event
+event_bus = create_event_bus(config.EVENTS_PUBSUB_URL, config.EVENTS_CHANNEL, deliver_event)
 
 # Load events from file on startup
 load_events_from_file()
 
 
+@app.on_event("startup")
+async def start_event_bus():
+    """Start relaying webhook events published by other web workers."""
+    await event_bus.start()
+
+
+def current_queue_depth() -> int:
+    """Admitted work not yet done: replies counting down plus events buffered for SSE clients."""
+    now = time.time()
+    return sum(reply["due_at"] > now for reply in pending_replies.values()) + sum(client_queue.qsize() for client_queue in CLIENTS)
+
+
+# Measures event-loop lag, logs the call site of blocking calls and feeds admission control
+loop_watchdog = LoopWatchdog(
+    interval=config.WATCHDOG_INTERVAL_MS / 1000,
+    stall_threshold=config.WATCHDOG_STALL_THRESHOLD_MS / 1000,
+    strict_stall=config.WATCHDOG_STRICT_STALL_MS / 1000 if config.WATCHDOG_STRICT_STALL_MS > 0 else None,
+    on_lag=admission.observe_loop_lag,
+)
+
+
+@app.on_event("startup")
+async def start_loop_watchdog():
+    """Start measuring event-loop lag."""
+    loop_watchdog.start()
+
+
+@app.middleware("http")
+async def track_webhook_ack(request: Request, call_next):
+    """Record how long webhook deliveries take to acknowledge, for admission control."""
+    if request.url.path != "/webhook" or request.method != "POST":
+        return await call_next(request)
+    started = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        admission.record_ack(time.perf_counter() - started)
+
+
+@app.on_event("startup")
+async def restore_pending_state():
+    """Reschedule replies saved by the previous shutdown, spreading out any that fell due meanwhile."""
+    snapshot = claim_snapshot(config.SNAPSHOT_FILE)
+    if not snapshot:
+        return
+    restored = spread_due_times(snapshot["replies"], time.time(), config.RESTORE_SPREAD_SECONDS)
+    for reply in restored:
+        args = reply["args"]
+        if reply["task"] == "send_dm":
+            conversation_id = args[0]
+            message_queue[conversation_id] = args[1][conversation_id]
+        result = schedule_reply(
+            celery.tasks[reply["task"]], tuple(args), reply["delay"], reply["expires_after"],
+            reply["kind"], reply["score"], reply["account_id"], kwargs=reply.get("kwargs")
+        )
+        if reply["task"] == "send_dm":
+            conversation_task_schedules[conversation_id] = result.id
+            if reply.get("debounce"):
+                # Keep counting max_total_wait from the burst's first message
+                dm_debounce.restore_burst(conversation_id, reply["debounce"], pending_replies[result.id]["due_at"])
+    logger.info(f"Restored {len(restored)} of {len(snapshot['replies'])} pending replies from {config.SNAPSHOT_FILE}")
+
+
+def snapshot_pending_state():
+    """Save replies that have not been sent yet so the next start can resume them."""
+    now = time.time()
+    replies, task_ids = [], []
+    for task_id, reply in pending_replies.items():
+        if reply["due_at"] <= now and celery.AsyncResult(task_id).state != "PENDING":
+            continue  # Started or finished on a worker; due replies still waiting in the broker are kept
+        reply = dict(reply, args=list(reply["args"]))
+        if reply["task"] == "send_dm":
+            conversation_id = reply["args"][0]
+            if not message_queue.get(conversation_id):
+                continue  # Nothing left to answer
+            reply["args"][1] = {conversation_id: message_queue[conversation_id]}
+            reply["debounce"] = dm_debounce.export_burst(conversation_id)
+        replies.append(reply)
+        task_ids.append(task_id)
+
+    if replies:
+        celery.control.revoke(task_ids, terminate=False)  # One broadcast; a persistent broker must not send them as well
+        snapshot_path = save_snapshot(config.SNAPSHOT_FILE, replies)
+        logger.info(f"Saved {len(replies)} pending replies to {snapshot_path}")
+
+
+@app.on_event("shutdown")
+async def shutdown_server():
+    """
+    Shut down in order: snapshot pending replies, stop the event bus, then stop the watchdog.
+
+    Uvicorn has already finished in-flight requests (--timeout-graceful-shutdown) when this runs.
+    The watchdog goes last because in strict mode it raises, which would skip later handlers.
+    """
+    try:
+        snapshot_pending_state()
+        await event_bus.stop()
+    finally:
+        await loop_watchdog.stop()
+
+
 @app.get("/ping")
 def ping():
     """Health check endpoint to verify server is running."""
@@ -450,10 +1038,61 @@ async def health_check():
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "uptime_seconds": uptime_seconds,
-        "system_metrics": system_stats
+        "system_metrics": system_stats,
+        "dm_debounce": dm_debounce.stats(),
+        "admission": admission.stats(),
+        "event_loop_lag": loop_watchdog.histogram()
     }
 
 
+@app.get("/debug/profile")
+async def debug_profile(
+    request: Request,
+    seconds: float = Query(10, gt=0),
+    output_format: str = Query("collapsed", alias="format")
+):
+    """
+    Profile this web worker with a statistical sampler over all threads.
+
+    Sampling runs in a separate thread so the event loop keeps serving traffic
+    (and shows up in the profile) during the window.
+
+    Args:
+        request: FastAPI Request object, used to read the debug token.
+        seconds: Length of the sampling window, capped at PROFILE_MAX_SECONDS.
+        output_format: 'collapsed' (flamegraph.pl input) or 'speedscope' (JSON for speedscope.app).
+
+    Returns:
+        The collapsed stacks as plain text, or the speedscope document as JSON.
+
+    Raises:
+        HTTPException: 404 if profiling is disabled, 401 for a bad token, 400 for an unknown
+            format, 409 if a profile is already running.
+    """
+    if not config.PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found") # Profiling disabled
+
+    token = request.headers.get("Authorization", "")
+    if token.startswith("Bearer "):
+        token = token[7:]
+    if not hmac.compare_digest(token.encode('utf-8'), config.PROFILE_TOKEN.encode('utf-8')):
+        raise HTTPException(status_code=401, detail="Invalid debug token")
+
+    seconds = min(seconds, config.PROFILE_MAX_SECONDS)
+    try:
+        result = await asyncio.to_thread(
+            sample_profile, seconds, config.PROFILE_INTERVAL_MS / 1000, output_format, f"web worker {os.getpid()}"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if output_format == "speedscope":
+        return result
+    return PlainTextResponse(result)
+
+
 async def verify_webhook_signature(request: Request, raw_body: bytes) -> bool:
     """
     Verify that the webhook request is indeed from Meta by checking the signature.
@@ -534,12 +1173,18 @@ async def webhook(request: Request):
     Raises:
         HTTPException: 400 Bad Request if JSON payload is invalid, 403 Forbidden if signature is invalid.
     """
+    started = time.perf_counter()  # Inline LLM calls must fit in the ack budget
     raw_body = await request.body() # Get raw request body as bytes
     logger.info(f"Received raw webhook payload: {raw_body.decode('utf-8')}")
 
     if not await verify_webhook_signature(request, raw_body): # Verify webhook signature
         raise HTTPException(status_code=403, detail="Invalid signature") # Signature verification failed
 
+    # Decide how much of this webhook's work to admit given the current load
+    level = admission.update(current_queue_depth())
+    dm_kwargs = {"template_only": True} if level >= TEMPLATE_ONLY else None
+    comment_defer = config.ADMISSION_COMMENT_DEFER_SECONDS if level >= DEFER_COMMENTS else 0
+
     try:
         payload = json.loads(raw_body) # Parse JSON payload
         event_with_time = {
@@ -557,14 +1202,18 @@ async def webhook(request: Request):
             if event["type"] == "direct_message" and event["is_echo"] == False:
                 conversation_id = str(event["sender_id"]) + "_" + str(event["recipient_id"])
                 account_id_to_use = str(event["recipient_id"])  # Use recipient_id as account_id
+                delay = dm_debounce.observe(conversation_id, account_id_to_use)  # Adaptive quiet period
+
+                if dm_kwargs:
+                    admission.record_shed("template_only_replies")
 
                 if conversation_id not in message_queue:
                     # New conversation
                     message_queue[conversation_id] = [event] # Initialize message queue for conversation
-                    delay = random.randint(1 * 60, 2 * 60)  # Initial delay (1-2 minutes)
-                    task = send_dm.apply_async(
-                        args=(conversation_id, message_queue.copy(), account_id_to_use),  # Pass account_id
-                        countdown=delay, expires=delay + 3600 # Task expires after 1 hour + delay
+                    task = schedule_reply(
+                        send_dm, (conversation_id, message_queue.copy(), account_id_to_use),  # Pass account_id
+                        delay, 3600,  # Task expires after 1 hour + delay
+                        "direct_message", sentiment_score(event["text"] or ""), account_id_to_use, kwargs=dm_kwargs
                     )
                     conversation_task_schedules[conversation_id] = task.id  # Track scheduled task ID
                     logger.info(f"Scheduled initial DM task for new conversation: {conversation_id}, task_id: {task.id}, delay: {delay}s, account_id: {account_id_to_use}")
@@ -574,19 +1223,21 @@ async def webhook(request: Request):
                     message_queue[conversation_id].append(event) # Append new message to existing conversation queue
                     logger.info(f"Added message to existing conversation: {conversation_id}")
 
-                    # Re-schedule send_dm task with a shorter delay upon new message
+                    # Re-schedule send_dm task, restarting the quiet period from this message
                     if conversation_id in conversation_task_schedules:
                         task_id_to_extend = conversation_task_schedules[conversation_id]
                         celery.control.revoke(task_id_to_extend, terminate=False)  # Cancel existing task
+                        pending_replies.pop(task_id_to_extend, None)
                         del conversation_task_schedules[conversation_id]  # Remove old task ID
 
-                        new_delay = 30  # Shorter delay for re-scheduling (e.g., 30 seconds)
-                        new_task = send_dm.apply_async(
-                            args=(conversation_id, message_queue.copy(), account_id_to_use),  # Pass account_id
-                            countdown=new_delay, expires=new_delay + 3600 # Task expires after 1 hour + new delay
+                        combined_text = "\n".join([msg["text"] or "" for msg in message_queue[conversation_id]])
+                        new_task = schedule_reply(
+                            send_dm, (conversation_id, message_queue.copy(), account_id_to_use),  # Pass account_id
+                            delay, 3600,  # Task expires after 1 hour + delay
+                            "direct_message", sentiment_score(combined_text), account_id_to_use, kwargs=dm_kwargs
                         )
                         conversation_task_schedules[conversation_id] = new_task.id  # Track new task ID
-                        logger.info(f"Re-scheduled DM task for conversation: {conversation_id}, task_id: {new_task.id}, new delay: {new_delay}s (due to new message), account_id: {account_id_to_use}")
+                        logger.info(f"Re-scheduled DM task for conversation: {conversation_id}, task_id: {new_task.id}, new delay: {delay}s (due to new message), account_id: {account_id_to_use}")
 
 
             elif event["type"] == "comment":  # Handle comment events
@@ -597,33 +1248,54 @@ async def webhook(request: Request):
                         break  # Skip processing comment from same account
 
                     else:
-                        sentiment = analyze_sentiment(event["text"]) # Analyze comment sentiment
-                        message_to_be_sent = llm_response(gemini_api_key, model_name, event["text"])  # Generate response using LLM
-                        if message_to_be_sent == Exception:
+                        score = sentiment_score(event["text"] or "")  # Scored once for both the default reply and the lane
+                        sentiment = sentiment_label(score) # Analyze comment sentiment
+                        message_to_be_sent = None
+                        remaining_budget = admission.ack_budget - (time.perf_counter() - started)
+                        if level >= TEMPLATE_ONLY or remaining_budget <= 0:
+                            admission.record_shed("template_only_replies")
+                        else:
+                            try:
+                                # Off the event loop, and bounded so the webhook is still acked in time. The
+                                # requests timeout is per connect/read, so wait_for enforces the total; a call
+                                # that overruns finishes in its thread and its result is discarded.
+                                message_to_be_sent = await asyncio.wait_for(
+                                    asyncio.to_thread(llm_response, gemini_api_key, model_name, event["text"], timeout=remaining_budget),
+                                    remaining_budget,
+                                )
+                                admission.record_downstream(ok=True)
+                            except asyncio.TimeoutError:
+                                logger.error(f"LLM response for comment {event['comment_id']} exceeded the ack budget. Using the default reply.")
+                                admission.record_downstream(ok=False)
+                            except Exception as e:
+                                logger.error(f"Error generating LLM response for comment {event['comment_id']}: {e}")
+                                admission.record_downstream(ok=False)
+                        if message_to_be_sent is None:
                             if sentiment == "Positive":
                                 message_to_be_sent = default_comment_response_positive
-                            else:   
+                            else:
                                 message_to_be_sent = default_comment_response_negative
-                        
+
                         account_id_to_use = event["to_id"]  # Use comment's 'to_id' as account_id
                         # Schedule the reply task
                         delay = random.randint(1 * 60, 2 * 60)  # 1 to 2 minutes delay for comment reply
-                        send_delayed_reply.apply_async(
-                            args=(event["comment_id"], message_to_be_sent, account_id_to_use),  # Pass account_id
-                            countdown=delay, expires=delay + 600 # Task expires after 10 minutes + delay
+                        schedule_reply(
+                            send_delayed_reply, (event["comment_id"], message_to_be_sent, account_id_to_use),  # Pass account_id
+                            delay, 600,  # Task expires after 10 minutes + delay
+                            "comment", score, account_id_to_use, defer_low_priority=comment_defer
                         )
                         logger.info(f"Scheduled reply task for comment {event['comment_id']} in {delay} seconds using account {account_id_to_use}")
                 else:
                     logger.warning(f"Comment received for unconfigured account ID: {event['to_id']}. Ignoring.")
                     # Optionally, handle comments for unconfigured accounts differently
 
-        # Store event and notify clients
-        WEBHOOK_EVENTS.append(event_with_time) # Add event to deque
-        save_events_to_file() # Save events to file
-
-        # Notify connected SSE clients
-        for client_queue in CLIENTS:
-            await client_queue.put(event_with_time) # Put event into each client queue
+        # Store event and notify SSE clients on this and every other web worker
+        if level >= SAMPLE_SIDE_WORK and not admission.keep_sample():
+            admission.record_shed("sse_events_dropped")
+            admission.record_shed("persistence_skipped")
+        else:
+            await event_bus.publish(event_with_time)
+            save_events_to_file() # Save events to file
 
         return {"success": True, "parsed_events": parsed_events} # Return success and parsed events
 
@@ -701,5 +1373,16 @@ async def events(request: Request):
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) # Run the FastAPI application
\ No newline at end of file
+    import sys
+
+    if sys.argv[1:2] == ["async-worker"]:
+        # python server.py async-worker [-Q dm,comments] [-c 200]
+        import argparse
+        parser = argparse.ArgumentParser(prog="server.py async-worker")
+        parser.add_argument("-Q", "--queues", default=config.ASYNC_WORKER_QUEUES, help="Comma-separated lanes to consume")
+        parser.add_argument("-c", "--concurrency", type=int, default=config.ASYNC_WORKER_CONCURRENCY)
+        args = parser.parse_args(sys.argv[2:])
+        run_async_worker([queue.strip() for queue in args.queues.split(",") if queue.strip()], args.concurrency)
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8000) # Run the FastAPI application
\ No newline at end of file
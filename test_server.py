@@ -1,9 +1,415 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+import pytest
 from fastapi.testclient import TestClient
+
+import server
 from server import app
+from core.admission import AdmissionController, NORMAL, TEMPLATE_ONLY, SAMPLE_SIDE_WORK, DEFER_COMMENTS
+from core.async_worker import AsyncWorker
+from core.debounce import DebouncePolicy
+from core.profiler import sample_profile
+from core.pubsub import create_event_bus
+from core.routing import LaneRouter
+from core.snapshot import save_snapshot, claim_snapshot, spread_due_times
+from core.watchdog import LoopWatchdog, LoopStallError
+
+client = TestClient(app)  # Does not run startup/shutdown handlers
+
+
+def post_signed_webhook(payload, test_client=client):
+    """POST a webhook payload to /webhook, signed with the app secret as Meta does."""
+    body = json.dumps(payload).encode()
+    signature = hmac.new(server.APP_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return test_client.post("/webhook", content=body, headers={"X-Hub-Signature-256": f"sha256={signature}"})
+
+
+@pytest.fixture
+def lifespan_client(tmp_path, monkeypatch):
+    """
+    TestClient that runs the startup and shutdown handlers.
+
+    With WATCHDOG_STRICT_STALL_MS set, a test using it fails at teardown if it stalled the event loop.
+    """
+    monkeypatch.setattr(server.config, "SNAPSHOT_FILE", str(tmp_path / "pending.json.gz"))  # Keep shutdown snapshots out of the repo
+    with TestClient(app) as lifespan_test_client:
+        yield lifespan_test_client
 
-client = TestClient(app)
 
 def test_read_main():
     response = client.get("/ping")
     assert response.status_code == 200
     assert response.json() == {"message": "Server is active"}
+
+
+def test_event_bus_delivers_to_local_clients():
+    async def run():
+        client_queue = asyncio.Queue()
+        server.CLIENTS.append(client_queue)
+        try:
+            await server.event_bus.publish({"timestamp": "t", "payload": {"entry": []}})
+            return client_queue.get_nowait()
+        finally:
+            server.CLIENTS.remove(client_queue)
+
+    assert asyncio.run(run()) == {"timestamp": "t", "payload": {"entry": []}}
+    assert server.WEBHOOK_EVENTS[-1] == {"timestamp": "t", "payload": {"entry": []}}
+
+
+def test_redis_event_bus_relays_only_other_workers_events():
+    delivered = []
+
+    async def deliver(event):
+        delivered.append(event)
+
+    bus = create_event_bus("redis://localhost:6379/0", "webhook_events", deliver)
+    own = json.dumps({"origin": bus.worker_id, "event": {"id": 1}})
+    other = json.dumps({"origin": "other-worker", "event": {"id": 2}})
+    asyncio.run(bus.handle_message(own))
+    asyncio.run(bus.handle_message(other))
+    assert delivered == [{"id": 2}]
+
+
+def test_debug_profile_requires_token(monkeypatch):
+    monkeypatch.setattr(server.config, "PROFILE_TOKEN", "")
+    assert client.get("/debug/profile?seconds=0.1").status_code == 404
+
+    monkeypatch.setattr(server.config, "PROFILE_TOKEN", "secret")
+    assert client.get("/debug/profile?seconds=0.1", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+    response = client.get("/debug/profile?seconds=0.2&format=speedscope", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert response.json()["profiles"]
+
+
+def test_stack_sampler_collapsed_output():
+    stop = threading.Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            time.sleep(0.001)
+
+    worker = threading.Thread(target=busy_loop, name="busy")
+    worker.start()
+    try:
+        output = sample_profile(0.2, 0.005)
+    finally:
+        stop.set()
+        worker.join()
+    assert any(line.startswith("busy;") and "busy_loop" in line for line in output.splitlines())
+
+
+def test_debounce_policy_adapts_to_typing_gaps():
+    policy = DebouncePolicy(min_delay=5, max_delay=120, max_total_wait=90, default_delay=45)
+
+    # No history yet: default window
+    assert policy.observe("c1", "acct", now=0) == 45
+
+    # A fast typist: the window shrinks to the observed gaps (2s * 1.5 margin, floored at min_delay)
+    for t in (2, 4, 6):
+        delay = policy.observe("c1", "acct", now=t)
+    assert delay == 5
+
+    # A new conversation on the same account borrows the account's gap distribution
+    assert policy.observe("c2", "acct", now=1000) == 5
+
+    # The total wait since the first message of a burst is capped
+    slow = DebouncePolicy(min_delay=5, max_delay=120, max_total_wait=90, default_delay=60)
+    slow.observe("c3", "acct", now=0)
+    assert slow.observe("c3", "acct", now=50) == 40
+
+
+def test_debounce_policy_counts_split_replies():
+    policy = DebouncePolicy(min_delay=5, max_delay=120, max_total_wait=90, default_delay=10, split_window=60)
+    policy.observe("c1", "acct", now=0)  # Reply due at t=10
+    policy.observe("c1", "acct", now=30)  # Arrives after the reply went out
+    stats = policy.stats(now=1000)
+    assert stats["replies"] == 2
+    assert stats["split_replies"] == 1
+    assert stats["median_reply_latency_seconds"] == 10
+
+
+def test_debounce_policy_window_does_not_drift_over_conversation_turns():
+    policy = DebouncePolicy(min_delay=15, max_delay=120, max_total_wait=180, default_delay=45, split_window=120)
+
+    # Each turn the user answers our reply 20s later with two messages 4s apart
+    now, windows = 0.0, []
+    for _ in range(8):
+        policy.observe("c1", "acct", now=now)
+        delay = policy.observe("c1", "acct", now=now + 4)
+        windows.append(delay)
+        now += 4 + delay + 20
+
+    assert windows == sorted(windows, reverse=True)  # Never grows
+    assert windows[-1] == 15  # Learned from the 4s typing gaps, floored at min_delay
+
+
+def test_lane_router_escalates_and_defers_busy_accounts():
+    router = LaneRouter({"dm": 3, "comments": 6, "escalations": 0}, escalation_threshold=-0.3)
+
+    assert router.route("direct_message", 0.5, "a", now=0) == {"queue": "dm", "priority": 3, "defer": 0}
+    assert router.route("comment", -0.8, "a", now=0) == {"queue": "escalations", "priority": 0, "defer": 0}
+
+    # One account floods the comment lane and is deferred; a quiet account is not
+    assert router.route("comment", 0.9, "quiet", now=1)["defer"] == 0
+    for _ in range(20):
+        flood = router.route("comment", 0.9, "viral", now=1)
+    assert flood == {"queue": "comments", "priority": 6, "defer": 4 * 30}  # 19x the quiet account's load
+    assert router.route("comment", 0.9, "quiet", now=2)["defer"] == 0
+
+
+def test_async_worker_runs_tasks_as_coroutines_and_honours_revoke():
+    done = []
+
+    async def fake_reply(comment_id, message_to_be_sent, account_id_to_use):
+        await asyncio.sleep(0.2)
+        done.append(comment_id)
+        return {"id": comment_id}
+
+    worker = AsyncWorker(
+        server.celery, {"send_delayed_reply": fake_reply}, queues=["comments"], concurrency=50, prefetch=100,
+        hostname="async@test", control_handlers={"queue_wait": lambda state: {"comments": {"count": 0}}},
+    )
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    try:
+        time.sleep(0.5)
+        start = time.time()
+        for i in range(50):
+            server.send_delayed_reply.apply_async(args=(str(i), "hi", "acct"), queue="comments")
+        revoked = server.send_delayed_reply.apply_async(args=("revoked", "hi", "acct"), queue="comments", countdown=1)
+        server.celery.control.revoke(revoked.id)
+        time.sleep(0.1)
+        inspect = server.celery.control.inspect(destination=["async@test"], timeout=2)
+        active = inspect.active()
+        queue_wait = inspect._request("queue_wait")
+        while len(done) < 50 and time.time() - start < 10:
+            time.sleep(0.05)
+        elapsed = time.time() - start
+        time.sleep(1.5)
+    finally:
+        worker.stop()
+        thread.join(10)
+
+    assert len(done) == 50
+    assert elapsed < 5  # 50 x 0.2s tasks ran concurrently, not one after another
+    assert "revoked" not in done
+    assert active["async@test"] and {task["name"] for task in active["async@test"]} == {"send_delayed_reply"}
+    assert queue_wait == {"async@test": {"comments": {"count": 0}}}
+    assert not thread.is_alive()
+
+
+def test_pending_replies_survive_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(server.config, "SNAPSHOT_FILE", str(tmp_path / "pending.json.gz"))
+    monkeypatch.setattr(server, "message_queue", {})
+    monkeypatch.setattr(server, "conversation_task_schedules", {})
+    monkeypatch.setattr(server, "pending_replies", {})
+    monkeypatch.setattr(server, "dm_debounce", DebouncePolicy(min_delay=5, max_delay=60, max_total_wait=300, default_delay=30))
+
+    event = {"type": "direct_message", "sender_id": "user", "recipient_id": "acct", "text": "hi"}
+    server.message_queue["user_acct"] = [event]
+    first_at = time.time() - 100
+    server.dm_debounce.observe("user_acct", "acct", now=first_at)
+    server.schedule_reply(server.send_dm, ("user_acct", server.message_queue.copy(), "acct"), 30, 3600, "direct_message", 0.5, "acct")
+    server.schedule_reply(server.send_delayed_reply, ("comment1", "thanks!", "acct"), 60, 600, "comment", 0.5, "acct")
+    server.schedule_reply(server.send_delayed_reply, ("comment2", "thanks!", "acct"), 0, 600, "comment", 0.5, "acct")  # Due, not consumed
+    running = server.schedule_reply(server.send_delayed_reply, ("comment3", "thanks!", "acct"), 0, 600, "comment", 0.5, "acct")
+    server.celery.backend.mark_as_started(running.id)  # Being sent right now; must not be sent again after restart
+
+    revoked = []
+    monkeypatch.setattr(server.celery.control, "revoke", lambda task_ids, terminate=False: revoked.append(task_ids))
+    server.snapshot_pending_state()
+    assert len(revoked) == 1 and len(revoked[0]) == 3  # One broadcast for all snapshotted replies
+    assert os.path.exists(f"{server.config.SNAPSHOT_FILE}.{os.getpid()}")
+
+    # Simulate a fresh process
+    server.message_queue.clear()
+    server.pending_replies.clear()
+    server.dm_debounce = DebouncePolicy(min_delay=5, max_delay=60, max_total_wait=300, default_delay=30)
+    asyncio.run(server.restore_pending_state())
+
+    assert server.message_queue["user_acct"] == [event]
+    assert server.conversation_task_schedules["user_acct"] in server.pending_replies
+    assert sorted(reply["task"] for reply in server.pending_replies.values()) == ["send_delayed_reply", "send_delayed_reply", "send_dm"]
+    assert server.dm_debounce.export_burst("user_acct")["first_at"] == first_at  # max_total_wait keeps counting
+    assert not os.listdir(tmp_path)  # Claimed and removed
+
+
+def test_snapshots_of_workers_shutting_down_together_are_all_claimed(tmp_path):
+    path = str(tmp_path / "pending.json.gz")
+    os.rename(save_snapshot(path, [{"task": "send_dm", "due_at": 1}]), f"{path}.1")  # Another worker's file
+    save_snapshot(path, [{"task": "send_delayed_reply", "due_at": 2}])
+
+    snapshot = claim_snapshot(path)
+    assert sorted(reply["task"] for reply in snapshot["replies"]) == ["send_delayed_reply", "send_dm"]
+    assert claim_snapshot(path) is None
+
+
+def test_spread_due_times_spaces_out_overdue_replies():
+    replies = [
+        {"task": "send_dm", "due_at": 90, "expires_after": 3600},
+        {"task": "send_dm", "due_at": 80, "expires_after": 3600},
+        {"task": "send_delayed_reply", "due_at": 10, "expires_after": 60},  # Expired while down
+        {"task": "send_dm", "due_at": 130, "expires_after": 3600},
+    ]
+    delays = [round(reply["delay"]) for reply in spread_due_times(replies, now=100, spread_seconds=60)]
+    assert delays == [30, 1, 31]
+
+
+def test_admission_controller_steps_up_and_recovers():
+    controller = AdmissionController(max_queue_depth=100, max_loop_lag=0.25, max_error_rate=0.5, ack_budget=5, cooldown=30)
+
+    assert controller.update(queue_depth=10, now=0) == NORMAL
+    assert controller.update(queue_depth=120, now=1) == TEMPLATE_ONLY
+    controller.observe_loop_lag(0.6, now=2)
+    assert controller.update(queue_depth=10, now=2) == DEFER_COMMENTS
+
+    # Pressure gone: step down one level per cooldown period
+    assert controller.update(queue_depth=0, now=100) == DEFER_COMMENTS
+    assert controller.update(queue_depth=0, now=130) == DEFER_COMMENTS - 1
+    assert controller.update(queue_depth=0, now=160) == TEMPLATE_ONLY
+    assert controller.update(queue_depth=0, now=190) == NORMAL
+
+
+def test_webhook_sheds_work_under_overload(monkeypatch):
+    monkeypatch.setattr(server, "sentiment_score", lambda text: 0.5)
+    monkeypatch.setattr(server, "analyze_sentiment", lambda text: "Positive")
+    monkeypatch.setattr(server, "save_events_to_file", lambda: None)
+    monkeypatch.setattr(server, "message_queue", {})
+    monkeypatch.setattr(server, "pending_replies", {})
+    monkeypatch.setattr(server.admission, "update", lambda queue_depth: SAMPLE_SIDE_WORK)
+    monkeypatch.setattr(server.admission, "keep_sample", lambda: False)
+    server.admission.shed.clear()
+
+    response = post_signed_webhook({"entry": [{"messaging": [{
+        "sender": {"id": "user"}, "recipient": {"id": "acct"}, "message": {"mid": "m1", "text": "hello"}
+    }]}]})
+
+    assert response.status_code == 200
+    [reply] = server.pending_replies.values()
+    assert reply["kwargs"] == {"template_only": True}
+    shed = client.get("/health").json()["admission"]["shed"]
+    assert shed == {"template_only_replies": 1, "sse_events_dropped": 1, "persistence_skipped": 1}
+
+
+def test_webhook_comment_llm_call_runs_off_the_loop_within_ack_budget(monkeypatch):
+    calls = []
+
+    def fake_llm_response(api_key, model_name, query, timeout=None):
+        calls.append((threading.current_thread().name, timeout))
+        return "Thanks!"
+
+    monkeypatch.setattr(server, "llm_response", fake_llm_response)
+    monkeypatch.setattr(server, "sentiment_score", lambda text: 0.5)
+    monkeypatch.setattr(server, "save_events_to_file", lambda: None)
+    monkeypatch.setattr(server, "pending_replies", {})
+    monkeypatch.setattr(server, "ACCOUNT_CREDENTIALS", {"acct": "token"})
+    monkeypatch.setattr(server.admission, "update", lambda queue_depth: NORMAL)
+
+    response = post_signed_webhook({"entry": [{"id": "acct", "changes": [{
+        "field": "comments", "value": {"id": "c1", "text": "love it", "from": {"id": "user"}}
+    }]}]})
+
+    assert response.status_code == 200
+    [(thread_name, timeout)] = calls
+    assert thread_name.startswith("asyncio_")  # The loop's default executor, not the event loop thread
+    assert 0 < timeout <= server.admission.ack_budget
+    [reply] = server.pending_replies.values()
+    assert reply["args"][1] == "Thanks!"
+
+
+def test_webhook_falls_back_to_template_when_llm_overruns_ack_budget(lifespan_client, monkeypatch):
+    def slow_llm_response(api_key, model_name, query, timeout=None):
+        time.sleep(1)  # A slow stream: each read is within the requests timeout, the total is not
+        return "Too late"
+
+    monkeypatch.setattr(server, "llm_response", slow_llm_response)
+    monkeypatch.setattr(server, "sentiment_score", lambda text: 0.5)
+    monkeypatch.setattr(server, "save_events_to_file", lambda: None)
+    monkeypatch.setattr(server, "pending_replies", {})
+    monkeypatch.setattr(server, "ACCOUNT_CREDENTIALS", {"acct": "token"})
+    monkeypatch.setattr(server.admission, "update", lambda queue_depth: NORMAL)
+    monkeypatch.setattr(server.admission, "ack_budget", 0.2)
+
+    # The lifespan client keeps one event loop, as in production; the plain client's per-request
+    # loop would wait for the abandoned thread when it closes
+    started = time.perf_counter()
+    response = post_signed_webhook({"entry": [{"id": "acct", "changes": [{
+        "field": "comments", "value": {"id": "c1", "text": "love it", "from": {"id": "user"}}
+    }]}]}, lifespan_client)
+
+    assert response.status_code == 200
+    assert time.perf_counter() - started < 0.8
+    [reply] = server.pending_replies.values()
+    assert reply["args"][1] == server.default_comment_response_positive
+
+
+def test_loop_watchdog_reports_blocking_call_site():
+    def blocking_helper():
+        time.sleep(0.3)
+
+    async def run():
+        watchdog = LoopWatchdog(interval=0.02, stall_threshold=0.05, strict_stall=0.1)
+        watchdog.start()
+        await asyncio.sleep(0.1)
+        blocking_helper()  # Blocks the event loop
+        await asyncio.sleep(0.1)
+        try:
+            await watchdog.stop()
+        finally:
+            assert watchdog.histogram()["stalls"] == 1
+            assert watchdog.histogram()["buckets_ms"]["+Inf"] == watchdog.histogram()["count"]
+
+    with pytest.raises(LoopStallError, match="blocking_helper"):
+        asyncio.run(run())
+
+
+def test_loop_watchdog_forgets_stalls_of_previous_run():
+    watchdog = LoopWatchdog(interval=0.02, stall_threshold=0.05, strict_stall=0.1)
+
+    async def run(block):
+        watchdog.start()
+        await asyncio.sleep(0.1)
+        if block:
+            time.sleep(0.3)  # Blocks the event loop
+            await asyncio.sleep(0.1)
+        await watchdog.stop()
+
+    with pytest.raises(LoopStallError):
+        asyncio.run(run(block=True))
+    asyncio.run(run(block=False))  # A clean run on the same watchdog passes
+    assert watchdog.histogram()["stalls"] == 0
+
+
+def test_lane_router_does_not_defer_equal_traffic():
+    router = LaneRouter({"dm": 3, "comments": 6, "escalations": 0}, escalation_threshold=-0.3)
+
+    defers = [router.route("direct_message", 0.5, account, now=i)["defer"] for i, account in enumerate("ab" * 20)]
+    assert defers == [0] * 40
+
+
+def test_health_reports_loop_lag_while_app_runs(lifespan_client):
+    time.sleep(0.5)  # Let the watchdog heartbeat a few times
+    assert lifespan_client.get("/health").json()["event_loop_lag"]["count"] > 0
+
+
+def test_strict_watchdog_fails_shutdown_after_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(server.config, "SNAPSHOT_FILE", str(tmp_path / "pending.json.gz"))
+    monkeypatch.setattr(server, "pending_replies", {})
+    monkeypatch.setattr(server.loop_watchdog, "strict_stall", 0.1)  # The app's own watchdog, reused by later lifespans
+
+    with pytest.raises(LoopStallError):
+        with TestClient(app) as lifespan_test_client:
+            server.schedule_reply(server.send_delayed_reply, ("comment1", "thanks!", "acct"), 60, 600, "comment", 0.5, "acct")
+            lifespan_test_client.portal.call(time.sleep, 0.3)  # Blocks the event loop
+
+    assert os.path.exists(f"{server.config.SNAPSHOT_FILE}.{os.getpid()}")  # Shutdown work ran before the stall was reported
+
+    with TestClient(app):  # The next lifespan starts with a clean slate
+        pass